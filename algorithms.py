@@ -91,14 +91,16 @@ class PitchAlgorithm(Algorithm):
 
 
 # dynamics algorithms
-# supported types: [ 'gaps' ]
+# supported types: [ shannon_index, simpson_index, gini_simpson_index, gap_entropy ]
 class DynamicsAlgorithm(Algorithm):
 
-    valid_algorithms = ['shannon_index']
+    valid_algorithms = ['shannon_index', 'simpson_index', 'gini_simpson_index', 'gap_entropy']
     valid_params = ['window_size', 'gap_column_threshold', 'gap_window_threshold','criteria', 'levels']
 
     SHANNON_INDEX = 'shannon_index'
-    SIMPSON_INDEX = 'simpsonl_index'
+    SIMPSON_INDEX = 'simpson_index'
+    GINI_SIMPSON_INDEX = 'gini_simpson_index'
+    GAP_ENTROPY = 'gap_entropy'
 
     def __init__(self, algorithm, **kwargs):
         super(DynamicsAlgorithm, self).__init__(algorithm, **kwargs)
@@ -1,5 +1,7 @@
 from bio import gen_alignment, gen_random_seqs
-from music import gen_song
+from columns import ColumnProfile
+from encoding import encode, decode_string, UNKNOWN_CODE
+from music import gen_song, iter_song
 
 import numpy as np
 
@@ -16,7 +18,8 @@ def load_seq_config(filepath):
     len = data[u'length']
     del data[u'length']
 
-    seqs = np.zeros((np.alen(data.keys()), len), dtype="S1")
+    # sequences are kept encoded (see core.encoding); positions not covered are unknown
+    seqs = np.full((np.alen(data.keys()), len), UNKNOWN_CODE, dtype=np.uint8)
     i = 0
     for k in data.keys():
 
@@ -33,11 +36,11 @@ def load_seq_config(filepath):
 
             idx = [int(_idx) for _idx in idx]
             if symbol != 'R':
-                seqs[i][idx[0]:idx[1]] = symbol
+                seqs[i][idx[0]:idx[1]] = encode(str(symbol))
             else:
-                seqs[i][idx[0]:idx[1]] = np.random.choice(['a','g','c','t','-'], idx[1] - idx[0])
+                seqs[i][idx[0]:idx[1]] = encode(np.random.choice(['a','g','c','t','-'], idx[1] - idx[0]))
 
-            print idx[0], idx[1], seqs[i][idx[0]:idx[1]]
+            print idx[0], idx[1], decode_string(seqs[i][idx[0]:idx[1]])
         i += 1
 
     return seqs
\ No newline at end of file
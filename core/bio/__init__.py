@@ -10,9 +10,13 @@ import numpy as np
 from music21.instrument import PitchedPercussion
 
 from config import GLOBALS
+from core.columns import ColumnProfile, alignment_to_array
+from core.encoding import SYMBOLS, encode
 import os
 import sys
 import random
+import json
+import struct
 
 import time
 
@@ -33,16 +37,40 @@ def generator_from_iterable(iterable, n):
 # retrieves a distance matrix from:
 #   a) a multiple sequence alignment
 #   b) a file containing a multiple sequence alignment
+#   c) the column profile of a multiple sequence alignment
 def get_distance_matrix(msa):
+
+    if isinstance(msa, ColumnProfile):
+        return get_identity_distances(msa)
+
     calculator = DistanceCalculator('identity')
     distance_matrix = calculator.get_distance(msa)
 
     return np.array([row for row in distance_matrix])
 
 
+# identity distances between all rows of a column profile
+# (same as DistanceCalculator('identity'): 1 - matching positions / length)
+def get_identity_distances(profile):
+    assert isinstance(profile, ColumnProfile)
+
+    n_rows, n_cols = profile.shape
+    matches = np.zeros((n_rows, n_rows))
+
+    # one matrix product per symbol counts the positions where both rows hold it
+    for code in np.nonzero(np.sum(profile.counts, axis=0))[0]:
+        occurrences = (profile.codes == code).astype(np.float32)
+        matches += np.dot(occurrences, occurrences.T)
+
+    distances = 1 - matches / n_cols
+    np.fill_diagonal(distances, 0)
+
+    return distances
+
+
 # clusters all sequences in a MSA
 def get_clusters_from_alignment(msa, **kwargs):
-    assert isinstance(msa, MultipleSeqAlignment)
+    assert isinstance(msa, MultipleSeqAlignment) or isinstance(msa, ColumnProfile)
 
     print 'Retrieving distance matrix'
     dm = get_distance_matrix(msa)
@@ -75,10 +103,15 @@ def get_clusters_from_alignment(msa, **kwargs):
 
             from scipy.cluster.hierarchy import dendrogram, linkage
             from scipy.cluster.hierarchy import fcluster
+            from scipy.spatial.distance import squareform
+
+            method = kwargs['method'] if 'method' in kwargs.keys() else 'single'
 
             print 'Retrieving cluster tree'
 
-            Z = linkage(dm)
+            # linkage takes the condensed (upper triangle) distances; a square
+            # matrix would be read as observations and measured again
+            Z = linkage(squareform(dm, checks=False), method=method)
 
             """if 'dendrogram' in kwargs.keys():
                 if kwargs['dendrogram']:
@@ -95,7 +128,7 @@ def get_clusters_from_alignment(msa, **kwargs):
                     plt.savefig('dendogram.png')
             """
 
-            max_d = 0.01  # TODO: make this dynamic
+            max_d = kwargs['max_d'] if 'max_d' in kwargs.keys() else 0.01  # TODO: make this dynamic
             clusters = fcluster(Z, max_d, criterion='distance')
 
         else:
@@ -171,6 +204,88 @@ def msa_to_phylip(msa):
 
     return out_file
 
+# binary alignment cache: magic, header size, JSON header (row names, shape
+# and alphabet) padded to 16 bytes and the (rows x columns) uint8 symbol codes
+ALIGNMENT_CACHE_MAGIC = 'MSAC'
+ALIGNMENT_CACHE_EXTENSION = '.msa'
+
+
+# writes the binary cache of an alignment (a MultipleSeqAlignment or an alignment file)
+def write_alignment_cache(alignment, cache_path, file_format='clustal'):
+
+    if isinstance(alignment, str):
+        alignment = AlignIO.read(alignment, file_format)
+
+    assert isinstance(alignment, MultipleSeqAlignment)
+
+    names = [record.id for record in alignment]
+    codes = encode(alignment_to_array(alignment))
+
+    header = json.dumps({'names': names, 'shape': list(codes.shape), 'symbols': list(SYMBOLS)})
+    header += ' ' * (-(len(ALIGNMENT_CACHE_MAGIC) + 4 + len(header)) % 16)
+
+    with open(cache_path, 'wb') as f:
+        f.write(ALIGNMENT_CACHE_MAGIC + struct.pack('<I', len(header)) + header)
+        f.write(codes.tostring())
+
+    return cache_path
+
+
+# opens a binary alignment cache; symbol codes are memory-mapped, not read
+# returns the column profile of the alignment and its row names
+def read_alignment_cache(cache_path):
+    assert os.path.isfile(cache_path), 'Alignment cache does not exist: ' + cache_path
+
+    with open(cache_path, 'rb') as f:
+        assert f.read(len(ALIGNMENT_CACHE_MAGIC)) == ALIGNMENT_CACHE_MAGIC, 'Invalid alignment cache ' + cache_path
+
+        header_size = struct.unpack('<I', f.read(4))[0]
+        header = json.loads(f.read(header_size))
+
+    offset = len(ALIGNMENT_CACHE_MAGIC) + 4 + header_size
+    codes = np.memmap(cache_path, dtype=np.uint8, mode='r', offset=offset, shape=tuple(header['shape']))
+
+    symbols = np.array([str(symbol) for symbol in header['symbols']], dtype='S1')
+
+    # caches written with another alphabet are translated (and loaded in memory)
+    if not np.array_equal(symbols, SYMBOLS):
+        codes = encode(symbols)[codes]
+
+    return ColumnProfile.from_codes(codes), [str(name) for name in header['names']]
+
+
+# column profile and row names of an alignment file, from its binary cache
+# the cache (next to the file) is written on first use and whenever the file is newer;
+# if it cannot be written (e.g. a read-only directory) the parsed alignment is used
+def load_alignment(path, file_format='clustal'):
+    assert os.path.isfile(path), 'Alignment file does not exist: ' + path
+
+    if path.endswith(ALIGNMENT_CACHE_EXTENSION):
+        return read_alignment_cache(path)
+
+    cache_path = path + ALIGNMENT_CACHE_EXTENSION
+
+    if not os.path.isfile(cache_path) or os.path.getmtime(cache_path) < os.path.getmtime(path):
+        alignment = AlignIO.read(path, file_format)
+
+        try:
+            print 'Writing alignment cache', cache_path
+            write_alignment_cache(alignment, cache_path)
+        except (IOError, OSError) as e:
+            print 'Alignment cache not written (' + str(e) + ')'
+
+            # an incomplete cache would be read on the next run
+            if os.path.isfile(cache_path):
+                try:
+                    os.unlink(cache_path)
+                except OSError:
+                    pass
+
+            return ColumnProfile(alignment), [str(record.id) for record in alignment]
+
+    return read_alignment_cache(cache_path)
+
+
 # generates a MSA from a file with a set of sequences
 # arguments can be:
 #   seq_vector: vector specifying subset of sequences by reference
@@ -0,0 +1,142 @@
+"""
+    Column profile of a multiple sequence alignment, shared by every stage
+    (dynamics, similarity and distances) so that the MSA is scanned only once
+"""
+
+import hashlib
+
+import numpy as np
+from Bio.Align import MultipleSeqAlignment
+
+from core.encoding import SYMBOLS, GAP_CODE, encode, decode
+
+# symbols counted per block of rows (bounds the temporary index matrix)
+COUNT_BLOCK_SIZE = 1 << 22
+
+
+# aux function
+# "S1" matrix of a MultipleSeqAlignment, built from the sequence bytes
+def alignment_to_array(alignment):
+
+    n_cols = alignment.get_alignment_length()
+    data = ''.join(str(record.seq) for record in alignment)
+
+    return np.frombuffer(data, dtype='S1').reshape((len(alignment), n_cols))
+
+
+# integer-coded view of an alignment:
+#   codes: (rows x columns) uint8 matrix with the canonical code of each symbol (see core.encoding)
+#   symbols: canonical alphabet (symbol of each code)
+#   counts: (columns x symbols) number of occurrences of each symbol per column
+#   gaps: (rows x columns) boolean mask of gapped positions (computed on access, not kept)
+# slicing a profile by columns returns views of these arrays, not copies
+class ColumnProfile(object):
+
+    # 'alignment' may be a MultipleSeqAlignment, a matrix of symbols ("S1")
+    # or an already encoded (uint8) matrix
+    def __init__(self, alignment):
+
+        assert isinstance(alignment, MultipleSeqAlignment) or \
+               (isinstance(alignment, np.ndarray) and len(alignment.shape) == 2), \
+               'Invalid alignment type ' + str(type(alignment))
+
+        if not isinstance(alignment, np.ndarray):
+            alignment = alignment_to_array(alignment)
+
+        self.symbols = SYMBOLS
+        self.codes = alignment if alignment.dtype == np.uint8 else encode(alignment)
+
+        self.gap_code = GAP_CODE
+
+        self.counts = self.__count_symbols__(self.codes, len(SYMBOLS))
+        self._content_hash = None
+
+    # builds the profile of an encoded alignment ('codes' may be a memory map)
+    @classmethod
+    def from_codes(cls, codes):
+        assert len(codes.shape) == 2 and codes.dtype == np.uint8
+
+        counts = cls.__count_symbols__(codes, len(SYMBOLS))
+        return cls.from_arrays(codes, counts)
+
+    # builds a profile sharing the arrays of another one (used for slices)
+    @classmethod
+    def from_arrays(cls, codes, counts):
+
+        profile = cls.__new__(cls)
+
+        profile.symbols = SYMBOLS
+        profile.codes = codes
+        profile.counts = counts
+
+        profile.gap_code = GAP_CODE
+        profile._content_hash = None
+
+        return profile
+
+    # counted in blocks of rows, so that a memory-mapped alignment is read once
+    # without holding more than COUNT_BLOCK_SIZE indices in memory
+    @staticmethod
+    def __count_symbols__(codes, n_symbols, block_size=COUNT_BLOCK_SIZE):
+
+        n_rows, n_cols = codes.shape
+        n_block_rows = max(1, block_size // max(1, n_cols))
+
+        counts = np.zeros((n_cols * n_symbols,), dtype=np.int64)
+
+        # flat index of (column, symbol) pairs
+        offsets = np.arange(n_cols) * n_symbols
+
+        for start in range(0, n_rows, n_block_rows):
+            flat = codes[start: start + n_block_rows] + offsets
+            counts += np.bincount(flat.ravel(), minlength=n_cols * n_symbols)
+
+        return counts.reshape((n_cols, n_symbols))
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def gaps(self):
+        return self.codes == self.gap_code
+
+    @property
+    def n_gaps(self):
+        return self.counts[:, self.gap_code]
+
+    # sha1 of the profile content; identifies an alignment (or region) across runs
+    @property
+    def content_hash(self):
+
+        if self._content_hash is None:
+
+            sha = hashlib.sha1()
+            sha.update(str(self.codes.shape))
+            sha.update(self.symbols.tostring())
+            sha.update(np.ascontiguousarray(self.codes).tostring())
+
+            self._content_hash = sha.hexdigest()
+
+        return self._content_hash
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    # profile[i:j] is the profile of columns i to j (a view)
+    def __getitem__(self, columns):
+        assert isinstance(columns, slice), 'Profiles can only be sliced by columns'
+
+        return ColumnProfile.from_arrays(self.codes[:, columns], self.counts[columns])
+
+    # same pieces as np.array_split(alignment, n, axis=1)
+    def split(self, n):
+
+        bounds = [len(x) for x in np.array_split(np.arange(self.shape[1]), n)]
+        bounds = np.concatenate(([0], np.cumsum(bounds)))
+
+        return [self[bounds[i]: bounds[i + 1]] for i in range(0, n)]
+
+    # symbols matrix ("S1" dtype) of the profile
+    def decode(self):
+        return decode(self.codes)
@@ -0,0 +1,53 @@
+"""
+    Canonical uint8 encoding of alignment symbols: GLOBALS['ALPHABET'] first,
+    then the remaining IUPAC codes and one code for any other character
+"""
+
+import numpy as np
+
+from config import GLOBALS
+
+# IUPAC nucleotide codes (ambiguous bases and uracil)
+IUPAC_SYMBOLS = ['n', 'r', 'y', 's', 'w', 'k', 'm', 'b', 'd', 'h', 'v', 'u']
+
+UNKNOWN_SYMBOL = '?'
+
+# symbol of each code
+SYMBOLS = np.array(GLOBALS['ALPHABET'] + [s for s in IUPAC_SYMBOLS if s not in GLOBALS['ALPHABET']] +
+                   [UNKNOWN_SYMBOL], dtype='S1')
+
+assert '-' in SYMBOLS, 'Gap symbol missing from alphabet'
+
+GAP_CODE = list(SYMBOLS).index('-')
+UNKNOWN_CODE = len(SYMBOLS) - 1
+
+# code of each byte; symbols are case insensitive and '.' is also a gap
+ENCODING_TABLE = np.full((256,), UNKNOWN_CODE, dtype=np.uint8)
+
+for code, symbol in enumerate(SYMBOLS):
+    ENCODING_TABLE[ord(symbol.lower())] = code
+    ENCODING_TABLE[ord(symbol.upper())] = code
+
+ENCODING_TABLE[ord('.')] = GAP_CODE
+
+
+# codes of a string or of an array of symbols ("S1"), with the same shape
+def encode(symbols):
+
+    if isinstance(symbols, str):
+        return ENCODING_TABLE[np.frombuffer(symbols, dtype=np.uint8)]
+
+    symbols = np.ascontiguousarray(symbols)
+    assert symbols.dtype == np.dtype('S1'), 'Invalid symbols type ' + str(symbols.dtype)
+
+    return ENCODING_TABLE[symbols.view(np.uint8)]
+
+
+# symbols ("S1") of an array of codes, with the same shape
+def decode(codes):
+    return SYMBOLS[codes]
+
+
+# string of a row of codes
+def decode_string(codes):
+    return SYMBOLS[codes].tostring()
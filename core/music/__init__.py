@@ -8,8 +8,6 @@ from Bio import Phylo
 from Bio import SeqIO
 from Bio.Align import AlignInfo, MultipleSeqAlignment
 
-from scipy.stats import itemfreq
-
 import numpy as np
 
 import datasketch as dk
@@ -18,6 +16,9 @@ import pandas as pd
 import os
 import sys
 import random
+import multiprocessing
+import collections
+import itertools
 
 from matplotlib import pyplot as plt
 
@@ -26,606 +27,408 @@ from music21.instrument import StringInstrument, WoodwindInstrument, BrassInstru
 from music21 import Music21Object
 
 from algorithms import *
-from config import GLOBALS, MIN_TEMPO
-from core.bio import msa_to_phylip
+from config import GLOBALS
+from core.bio import load_alignment
+from core.columns import ColumnProfile
+from core.music.diversity import DIVERSITY_INDICES, GAPPED_COLUMN_VALUES
+from core.music.events import gen_note_events, gen_rest_events, padding_durations, PartEvents, ScoreEvents
 
 
-def gen_dynamics_vector(msa, dynamics_algorithm):
-    # criteria: local, avg ou median entropy
-    assert isinstance(dynamics_algorithm, DynamicsAlgorithm)
-    assert 'window_size' in dynamics_algorithm.keys(), 'Empty window for dynamics algorithm'
-    assert dynamics_algorithm['algorithm'] == DynamicsAlgorithm.SHANNON_INDEX
+# aux function
+# applies a reduction (np.sum, np.average, np.median...) to consecutive
+# windows of a 1d vector; the last window may be shorter than the rest
+def window_reduce(values, window, func):
 
-    window = dynamics_algorithm['window_size']
+    n_full = len(values) // window
+    full = n_full * window
 
-    if 'gap_column_threshold' not in dynamics_algorithm.keys():
-        gap_column_threshold = 0.7
-    else:
-        gap_column_threshold = dynamics_algorithm['gap_column_threshold']
-
-    if 'gap_window_threshold' not in dynamics_algorithm.keys():
-        gap_window_threshold = 0.7
-    else:
-        gap_window_threshold = dynamics_algorithm['gap_window_threshold']
-
-    if 'criteria' not in dynamics_algorithm.keys():
-        criteria = 'local'
-    else:
-        criteria = dynamics_algorithm['criteria']
-
-    if 'levels' not in dynamics_algorithm.keys():
-        levels = 5
+    if n_full > 0:
+        reduced = func(values[:full].reshape((n_full, window)), axis=1)
     else:
-        levels = dynamics_algorithm['levels']
-
-    aln_len = len(msa[0])
-
-    from math import ceil
-
-    n_windows = np.int(ceil(float(aln_len) / window))
-
-    gaps_below_thresh = np.zeros(n_windows, dtype=np.bool)
-
-    window_idx = 0
-
-    # first iterating through MSA to identify
-    # which windows have a percentage of gaps
-    # below the established threshold
-    for i in range(0, aln_len, window):
-
-        boundary = window \
-            if i + window <= aln_len \
-            else aln_len - i
-
-        local_is_below_threshold = np.zeros((boundary,), dtype=np.bool)
-
-        for j in range(i, i + boundary):
-
-            column = np.array([c for c in msa[:, j]])
-
-            n_gaps = np.count_nonzero(column == '-')
-
-            if float(n_gaps) / len(column) < gap_column_threshold:
-                local_is_below_threshold[j - i] = True
-
-        n_ungapped_regions = len(np.where(local_is_below_threshold)[0])
-        print 'N ungapped regions', n_ungapped_regions, gap_window_threshold * boundary
-        if n_ungapped_regions >= gap_window_threshold * boundary:
-            gaps_below_thresh[window_idx] = True
-        window_idx += 1
-
-    #print('Gaps below thresh', gaps_below_thresh)
-
-    from scipy.stats import entropy
-
-    dynamics_vector = np.zeros((n_windows,),
-                               dtype=[('entropy', np.float), ('vol', np.float)])
-    entropies_idx = 0
-
-    for i in range(0, aln_len, window):
-        boundary = window \
-            if i + window <= aln_len \
-            else aln_len - i
+        reduced = np.array([], dtype=values.dtype)
 
-        # if this window has a percentage of gaps
-        # above the considered threshold
-        if not gaps_below_thresh[entropies_idx]:
-            dynamics_vector['entropy'][entropies_idx] = -1
-            entropies_idx += 1
-            continue
+    if full < len(values):
+        reduced = np.append(reduced, func(values[full:]))
 
-        local_entropy = np.zeros((boundary,))
+    return reduced
 
-        for j in range(i, i + boundary):
 
-            column = msa[:, j]
-            column_symbols = column[np.where(column != '-')]
+# per-column entropy (or other diversity index) and gap information of a whole
+# alignment, so that window statistics can be read for any window size (and any
+# piece offset) without rescanning the MSA; gaps are stored as cumulative sums
+class DynamicsIndex(object):
 
-            if len(column_symbols) < (1 - gap_column_threshold) * len(column):
-                # apply thresholding
-                #pass
-                local_entropy[j - i] = 0
-            else:
-                # Shannon entropy of all column symbols
-                counts = itemfreq(column_symbols)
-                counts = np.array([float(count) for count in counts[:, 1]])
+    def __init__(self, profile, gap_column_threshold=0.7, algorithm=DynamicsAlgorithm.SHANNON_INDEX):
+        assert algorithm in DIVERSITY_INDICES, 'Unsupported dynamics algorithm ' + str(algorithm)
 
-                counts /= np.sum(counts)
+        if not isinstance(profile, ColumnProfile):
+            profile = ColumnProfile(profile)
 
-                local_entropy[j - i] = entropy(counts, base=2)
+        n_rows = len(profile)
 
-        if criteria == 'local':
-            dynamics_vector['entropy'][entropies_idx] = np.sum(local_entropy)
-        elif criteria == 'average':
-            dynamics_vector['entropy'][entropies_idx] = np.average(local_entropy)
-        elif criteria == 'median':
-            dynamics_vector['entropy'][entropies_idx] = np.median(local_entropy)
-        else:
-            print 'Unsupported criteria ' + str(criteria) + ' for entropy aggregation'
-            sys.exit(1)
-
-        entropies_idx += 1
-
-    max_vol = 0.95
-    min_vol = 0.30
-
-    entropies = dynamics_vector['entropy']
-
-    split_info = np.array_split(np.sort(np.unique(entropies)), levels)  # splitting info into classes
-    volumes = np.linspace(min_vol, max_vol, num=levels)  # vector with all possible volumes
-
-    for i in range(0, int(n_windows)):
-
-        if entropies[i] == -1:
-            dynamics_vector['vol'][i] = -1
-
-        for j in range(0, len(split_info)):
-            if entropies[i] <= split_info[j][-1]:
-                dynamics_vector['vol'][i] = volumes[j]
-                break
-
-    return dynamics_vector
-
-
-def add_dynamics_to_score(dynamics_vector, score, window_size, instruments, max_rest_tempo=3):
+        counts = profile.counts
+        gap_idx = profile.gap_code
 
-    # consistency check
-    assert isinstance(score, stream.Score) and isinstance(dynamics_vector, np.ndarray)
-    assert len(instruments) == len(score.parts)
-    assert all(isinstance(i, instrument.Instrument) for i in instruments)
+        self.gap_column_threshold = gap_column_threshold
+        self.n_cols = len(counts)
 
-    score_tempo = score.getElementsByClass(tempo.MetronomeMark)[0]
-
-    # creating filtered score
-    # starting with empty parts
-    final_score = stream.Score()
-    length = np.inf
-
-    for p in range(0, len(score.parts)):
+        # columns with a percentage of gaps below the established threshold
+        self.ungapped = profile.n_gaps / float(n_rows) < gap_column_threshold
 
-        part_len = len(score.parts[p]) - 1 # excluding instrument elem!!
-        if part_len < length:
-            length = part_len
+        # diversity of all column symbols, see core.music.diversity
+        self.algorithm = algorithm
+        self.entropy = DIVERSITY_INDICES[algorithm](counts, gap_idx)
 
-        part = stream.Part()
-        part.insert(0, score_tempo)
-        part.insert(0, instruments[p])
+        # apply thresholding (columns with too many gaps have no diversity)
+        gapped_value = GAPPED_COLUMN_VALUES[algorithm]
 
-        final_score.append(part)
+        if gapped_value is not None:
+            n_symbols = n_rows - profile.n_gaps
+            self.entropy[n_symbols < (1 - gap_column_threshold) * n_rows] = gapped_value
 
-    # iterating through a music score in chunks of 'window_size' length
-    vol_idx = 0
-
-    for i in range(0, length, window_size):
-        boundary = window_size if i + window_size <= length else length - i
-
-        if dynamics_vector[vol_idx] <= 0: # silence
-            r = note.Rest()
-
-            for part in final_score.parts:
-                part.append(r)
-                part[-1].seconds = max_rest_tempo
-
-        else:
-            # iterating over parts
-            for j in range(0, len(final_score.parts)):
+        # prefix sums: window [i, j) is sums[j] - sums[i]
+        self.ungapped_sums = np.concatenate(([0], np.cumsum(self.ungapped)))
 
-                # scores have same number of parts
-                final_part = final_score.parts[j]
-                part = score.parts[j]
-
-                for k in range(i, i + boundary):
-
-                    n = part[k]
-                    if isinstance(n, note.GeneralNote):  # if Note or Rest
-
-                        final_part.append(n)
-                        if isinstance(n, note.Note):  # if Note
-
-                            final_part[-1].volume = dynamics_vector[vol_idx]
-
-        vol_idx += 1
-
-    print 'SECS', final_score[0].seconds
-
-    assert len(final_score.parts) == len(score.parts)
-    return final_score
-
-
-# returns a tuple containing:
-#   - a word distance vector per word (A,C,G,T)
-#   - a label array with the assigned duration of each nucleotide
-def gen_pitch_duration_vectors(sequence, pitch_algorithm, durations_algorithm):
-    assert isinstance(pitch_algorithm, PitchAlgorithm) and isinstance(durations_algorithm, DurationsAlgorithm)
-    assert sequence is not None
+    # index[i:j] is the index of columns i to j (views of the same arrays)
+    def __getitem__(self, columns):
+        assert isinstance(columns, slice) and columns.step is None, 'Dynamics indices can only be sliced by columns'
 
-    # step is the number of columns/characters that are mapped
-    length = len(sequence)
+        start, stop, _ = columns.indices(self.n_cols)
 
-    # auxiliary structures
-    distance_vectors = dict()  # keys are nucleotides; values are np arrays
-    last_occurrence = dict()  # aux dict used for word distances
+        index = DynamicsIndex.__new__(DynamicsIndex)
 
-    step = 1
-    window = 1500
-    window_duration = 8
+        index.gap_column_threshold = self.gap_column_threshold
+        index.algorithm = self.algorithm
+        index.n_cols = stop - start
 
-    for key in durations_algorithm.keys():
-        if key == 'n_nucleotides':
-            step = durations_algorithm['n_nucleotides']
-            assert isinstance(step, int) and step > 0
+        index.ungapped = self.ungapped[start: stop]
+        index.entropy = self.entropy[start: stop]
+        index.ungapped_sums = self.ungapped_sums[start: stop + 1]
 
-        elif key == 'window_size':
-            window = durations_algorithm['window_size']
-            assert isinstance(window, int) and window > 0
+        return index
 
-        elif key == 'window_duration':
-            window_duration = durations_algorithm['window_duration']
-            assert (isinstance(window_duration, float) or isinstance(window_duration, int)) and window > 0
+    # window boundaries of columns [start, stop) split by 'window'
+    def window_bounds(self, window, start=0, stop=None):
 
-    if 'n_nucleotides' in pitch_algorithm.keys():
-        assert step == pitch_algorithm['n_nucleotides']
+        if stop is None:
+            stop = self.n_cols
 
-    d_algorithm = durations_algorithm['algorithm']
-    p_algorithm = pitch_algorithm['algorithm']
+        assert 0 <= start < stop <= self.n_cols, 'Invalid columns interval ' + str(start) + ', ' + str(stop)
 
-    assert 'scale' in pitch_algorithm.keys()
+        lower = np.arange(start, stop, window)
+        upper = np.minimum(lower + window, stop)
 
-    if p_algorithm == PitchAlgorithm.WORD_FREQ:
-        scale = p_algorithm['scale']
-        pitch_freq_vectors = dict()
+        return lower, upper
 
-        assert len(scale) > 0
+    # number of ungapped columns and number of columns per window
+    def window_gaps(self, window, start=0, stop=None):
 
-    # splitting by window value
-    split_seq_len = int(length / window) if length % window == 0 else int(length / window) + 1
-    split_sequence = np.zeros((split_seq_len, window), dtype="S1")
+        lower, upper = self.window_bounds(window, start, stop)
+        return self.ungapped_sums[upper] - self.ungapped_sums[lower], upper - lower
 
-    for i in range(0, split_seq_len):
-        subseq = sequence[i * window: i * window + window]
-        split_sequence[i][: len(subseq)] = subseq
-        split_sequence[len(subseq):] = ''
+    # entropy of each window aggregated by criteria (local, average or median)
+    def window_entropies(self, window, criteria='local', start=0, stop=None):
 
-    sequence = split_sequence
+        lower, upper = self.window_bounds(window, start, stop)
 
-    n_nucleotide_split_len = int(window / step) if window % step == 0 else int(window / step) + 1
-    split_sequence = np.zeros((split_seq_len, n_nucleotide_split_len), dtype="S" + str(step))
+        # one pass over the windows; differences of float prefix sums would not be
+        # exact, and equal windows could fall in different volume classes
+        entropies = self.entropy[lower[0]: upper[-1]]
 
-    nucleotides_idx = 0
-    for i in range(0, len(sequence)):
-
-        subseq = sequence[i]
-        split_subseq = split_sequence[i]
-
-        for j in range(0, len(subseq), step):
-
-            for k in range(j, j + step):
-                split_subseq[nucleotides_idx] += subseq[k]
-
-            nucleotides_idx += 1
-
-        nucleotides_idx = 0
-
-    # sequence shape - [ [window] [window] ....]
-    # window shape - ['n-nucleotide' 'n-nucleotide' ....]
-    sequence = split_sequence
-
-    # print sequence
-    assert len(sequence.shape) == 2
-
-    offset = 0
-
-    # 1d ndarray containing durations in quarter lengths
-    durations = np.empty((sequence.shape[0] * sequence.shape[1],), dtype=np.float)
-
-    for i in range(0, len(sequence)):
-
-        # a window with n-nucleotide elements
-        subset = sequence[i]
-        # grouping frequencies of n-nucleotides  within a block
-        counts = dict(itemfreq(subset))
+        if criteria == 'local':
+            return window_reduce(entropies, window, np.sum)
+        elif criteria == 'average':
+            return window_reduce(entropies, window, np.mean)
+        elif criteria == 'median':
+            return window_reduce(entropies, window, np.median)
 
-        # This algorithm assigns durations dynamically to nucleotides
-        # based on their relative frequency
-        if d_algorithm == durations_algorithm.FREQUENCIES_DYNAMIC or p_algorithm == PitchAlgorithm.WORD_FREQ:
+        print 'Unsupported criteria ' + str(criteria) + ' for entropy aggregation'
+        sys.exit(1)
 
-            counts_sum = 0
 
-            # for j in range(i, bounverifiyingdary):
-            for j in range(0, len(subset)):
-                counts_sum += int(counts[subset[j]])
+# number of pieces from which pieces are clustered with an LSH index (see SimHandler)
+LSH_MIN_PIECES = 1000
 
-        total_time = 0.0
 
-        for j in range(0, len(subset)):
+# dynamics indices of recently used alignments
+# (parameter sweeps rebuild the composer for the same MSA)
+dynamics_indices = dict()
 
-            if subset[j] == '': continue
 
-            local_count = int(counts[subset[j]])
-            freq = float(local_count) / len(subset)
+# returns the dynamics index of an alignment profile, reusing
+# the one built previously for the same content, threshold and algorithm
+def get_dynamics_index(profile, gap_column_threshold=0.7, algorithm=DynamicsAlgorithm.SHANNON_INDEX):
+    assert isinstance(profile, ColumnProfile)
 
-            # pitch algorithm
-            if p_algorithm == PitchAlgorithm.WORD_DISTANCES or d_algorithm == DurationsAlgorithm.WORD_DISTANCES:
+    key = (profile.content_hash, gap_column_threshold, algorithm)
 
-                # TODO: optimization
-                #   fazer uma primeira passagem pela sequencia inteira
-                #   para saber o numero exato de nucleotidos e reservar np.arrays??
-                letter = subset[j]
+    if key not in dynamics_indices:
 
-                if letter not in distance_vectors.keys():
-                    distance_vectors[letter] = []
+        if len(dynamics_indices) >= 8:
+            dynamics_indices.clear()
 
-                else:
+        dynamics_indices[key] = DynamicsIndex(profile, gap_column_threshold, algorithm)
 
-                    diff = j + offset - last_occurrence[letter]
-                    distance_vectors[letter].append(diff)
+    return dynamics_indices[key]
 
-                last_occurrence[letter] = j + offset
 
-            if p_algorithm == PitchAlgorithm.WORD_FREQ:
+# 'msa' is an alignment (or its ColumnProfile); 'index' may hold the dynamics index
+# of a larger alignment, in which case 'msa' is the region starting at column 'offset'
+def gen_dynamics_vector(msa, dynamics_algorithm, index=None, offset=0):
+    # criteria: local, avg ou median entropy
+    assert isinstance(dynamics_algorithm, DynamicsAlgorithm)
+    assert 'window_size' in dynamics_algorithm.keys(), 'Empty window for dynamics algorithm'
+    assert dynamics_algorithm['algorithm'] in DIVERSITY_INDICES
 
-                # e.g. major scale - C-D-E-F-G-A-B-C
-                # obtain scale from p_algorithm
-                # assign fraction to each note of scale
-                # assign fraction of a note to a frequency
+    window = dynamics_algorithm['window_size']
 
-                len_scale = len(scale)
-                frac = 1.0 / len(scale)
+    if 'gap_column_threshold' not in dynamics_algorithm.keys():
+        gap_column_threshold = 0.7
+    else:
+        gap_column_threshold = dynamics_algorithm['gap_column_threshold']
 
-                for k in range(0, len_scale):
-                    val = frac * k
-                    if freq > val:
-                        continue
-                    else:
+    if 'gap_window_threshold' not in dynamics_algorithm.keys():
+        gap_window_threshold = 0.7
+    else:
+        gap_window_threshold = dynamics_algorithm['gap_window_threshold']
 
-                        if letter not in pitch_freq_vectors.keys():
-                            pitch_freq_vectors[letter] = []
+    if 'criteria' not in dynamics_algorithm.keys():
+        criteria = 'local'
+    else:
+        criteria = dynamics_algorithm['criteria']
 
-                        pitch_freq_vectors[letter].append(val)
+    if 'levels' not in dynamics_algorithm.keys():
+        levels = 5
+    else:
+        levels = dynamics_algorithm['levels']
 
-            # durations algorithm
-            # frequency-biased algorithms
-            if d_algorithm == DurationsAlgorithm.FREQUENCIES_DYNAMIC:
+    aln_len = msa.shape[1]
 
-                assert counts_sum is not None and counts_sum > 0, 'Inconsistent values for counts of characters in region'
+    if index is None:
+        index = DynamicsIndex(msa, gap_column_threshold, dynamics_algorithm['algorithm'])
+        offset = 0
 
-                local_duration = float(window_duration) * float(local_count) / float(counts_sum)
-                total_time += local_duration
+    assert isinstance(index, DynamicsIndex) and index.gap_column_threshold == gap_column_threshold \
+        and index.algorithm == dynamics_algorithm['algorithm']
 
-                # assert local_duration > MIN_TEMPO, \
-                #    'Higher tempo required for each subsequence; too short duration was calculated: ' + str(local_duration
-                if local_duration < MIN_TEMPO:
-                    local_duration = MIN_TEMPO
+    # identifying which windows have a percentage
+    # of gaps below the established threshold
+    n_ungapped_regions, boundaries = index.window_gaps(window, offset, offset + aln_len)
+    gaps_below_thresh = n_ungapped_regions >= gap_window_threshold * boundaries
 
-            # duration biased with discrete attributions
-            elif d_algorithm == DurationsAlgorithm.FREQUENCIES_DISCRETE:
+    print 'N ungapped regions', n_ungapped_regions, gap_window_threshold * boundaries
 
-                duration_labels = np.array(['32nd', '16th', 'eighth', 'quarter', 'half', 'whole'])
-                frequencies = np.linspace(0.0, 0.5, num=len(duration_labels) - 1)
+    n_windows = len(boundaries)
 
-                # dictionary mapping a discrete value for word frequencies to each duration label
-                duration_labels = {frequencies[k]: duration_labels[k] for k in range(0, len(duration_labels) - 1)}
-                duration_labels['whole'] = 1.0
+    dynamics_vector = np.zeros((n_windows,),
+                               dtype=[('entropy', np.float), ('vol', np.float)])
 
-                local_duration = '32nd'
-                keys = duration_labels.keys()
+    dynamics_vector['entropy'] = index.window_entropies(window, criteria, offset, offset + aln_len)
 
-                # finding correspondent label
-                for k in keys:
-                    if k > freq:
-                        local_duration = duration_labels[k]
-                        break
+    # if a window has a percentage of gaps
+    # above the considered threshold
+    dynamics_vector['entropy'][~gaps_below_thresh] = -1
 
-                # obtaining duration in quarter lengths
-                local_duration = duration.Duration(local_duration).quarterLength
-                total_time += local_duration
+    max_vol = 0.95
+    min_vol = 0.30
 
-            elif d_algorithm == DurationsAlgorithm.WORD_DISTANCES:
+    entropies = dynamics_vector['entropy']
 
-                duration_labels = np.array(['64th', '32nd', '16th', 'eighth', 'quarter', 'half', 'whole'])
+    split_info = np.array_split(np.sort(np.unique(entropies)), levels)  # splitting info into classes
+    volumes = np.linspace(min_vol, max_vol, num=levels)  # vector with all possible volumes
 
-                if len(distance_vectors[letter]) > 0:
-                    duration_label = duration_labels[distance_vectors[letter][-1] % len(duration_labels)]
-                else:
-                    duration_label = 'eighth'
+    # upper bound of each class; empty classes can only occur at the end
+    class_bounds = np.array([info[-1] for info in split_info if len(info) > 0])
 
-                local_duration = duration.Duration(duration_label).quarterLength
-                total_time += local_duration
+    dynamics_vector['vol'] = volumes[np.searchsorted(class_bounds, entropies, side='left')]
 
-            else:
-                print 'Invalid mapping introduced: ', d_algorithm['algorithm']
-                raise NotImplementedError
+    return dynamics_vector
 
-            # durations[j] = local_duration
-            durations[j + offset] = local_duration
 
-        if d_algorithm == DurationsAlgorithm.FREQUENCIES_DISCRETE or d_algorithm == DurationsAlgorithm.WORD_DISTANCES:
+# notes are assigned to the dynamics window of their source column;
+# rests added after the generated notes (padding) belong to the last window
+# volumes are applied in place on the part events; the (same) score is returned
+def add_dynamics_to_score(dynamics_vector, score, window_size, instruments, max_rest_tempo=3):
 
-            if round(float(total_time), 5) != round(float(window_duration), 5):
+    # consistency check
+    assert isinstance(score, ScoreEvents) and isinstance(dynamics_vector, np.ndarray)
+    assert len(instruments) == len(score.parts)
+    assert all(isinstance(i, instrument.Instrument) for i in instruments)
 
-                ratio = float(window_duration) / float(total_time)
-                total_time = 0.0
-                # for j in range(i, boundary):
-                for j in range(0, len(subset)):
-                    durations[j + offset] *= ratio
+    n_windows = len(dynamics_vector)
+    silent = dynamics_vector <= 0
 
-                    assert durations[j + offset] >= MIN_TEMPO, \
-                        'Higher tempo required for each subsequence; too short duration was calculated: ' + str(
-                            durations[j + offset])
+    # silent windows are replaced by a rest of 'max_rest_tempo' seconds
+    silence = gen_rest_events([score.seconds_to_quarter_length(max_rest_tempo)])
 
-                    total_time += durations[j + offset]
+    for p in range(0, len(score.parts)):
 
-        offset += len(subset)
+        part = score.parts[p]
+        events = part.events
 
-    if p_algorithm == PitchAlgorithm.WORD_DISTANCES:
+        # dynamics window of each note
+        windows = np.where(events['column'] >= 0, events['column'] // window_size, n_windows - 1)
+        windows = np.minimum(windows, n_windows - 1)
 
-        for x in distance_vectors.keys():  # iter(distance_vectors.items()):
+        notes = ~events['rest']
+        events['volume'][notes] = dynamics_vector[windows[notes]]
 
-            diff = offset + 1 - last_occurrence[x]
-            distance_vectors[x].append(diff)
+        if np.any(silent):
 
-        d_vectors_len = 0
+            # notes of window i are events[bounds[i]: bounds[i + 1]]
+            bounds = np.searchsorted(windows, np.arange(n_windows))
 
-        for x in distance_vectors.keys():
-            distance_vectors[x] = np.array(distance_vectors[x])
-            d_vectors_len += len(distance_vectors[x])
+            # position of each silent window once its notes are dropped
+            kept = ~silent[windows]
+            positions = np.append(0, np.cumsum(kept))[bounds[silent]]
 
-            # assert d_vectors_len * step == length, "Lengths don't match: sequence length = " + str(length) + "; d_vectors length: " + str(d_vectors_len)
-    else:
+            events = np.insert(events[kept], positions, np.repeat(silence, np.count_nonzero(silent)))
 
-        return pitch_freq_vectors, durations
+        part.events = events
+        part.instrument = instruments[p]
 
-    # (distances, frequencies per N words)
-    print 'PITCH DURATION VECTORS', distance_vectors, durations
-    return distance_vectors, durations
+    return score
 
 
-def gen_stream(score, sequence, pitch_algorithm, durations_algorithm, assigned_instrument):
+# 'sequence' is a row of symbols or, if 'symbols' is given, a row of codes of that alphabet
+# appends the part (as note events) to the score and returns its events
+# 'events' may hold the note events of the sequence if already generated (see gen_row_events)
+def gen_stream(score, sequence, pitch_algorithm, durations_algorithm, assigned_instrument, symbols=None,
+               events=None):
     assert isinstance(pitch_algorithm, PitchAlgorithm) and isinstance(durations_algorithm, DurationsAlgorithm)
+    assert isinstance(score, ScoreEvents)
 
     if 'window_size' in durations_algorithm.keys():
         assert len(sequence) > durations_algorithm['window_size'], \
             'Invalid piece and window size ' + str(len(sequence)) + ' ' + str(durations_algorithm['window_size'])
 
-    dv, durations = gen_pitch_duration_vectors(sequence, pitch_algorithm, durations_algorithm)
-
-    for x in dv.keys():
-        dv[x] = iter(dv[x])
-
-    durations = iter(durations)
-
-    # TODO: integrar esta parte no algoritmo anterior para poupar iteracoes
-    # scale_len = len(scale.MajorScale().getPitches())
-
-    assert 'scale' in pitch_algorithm.keys()
-    s = pitch_algorithm['scale']
-    scale_len = len(s)
-
-    assert isinstance(s, list) and len(s) > 1
+    # sequence is split in windows and n-nucleotides only once, here
+    if events is None:
+        events = gen_note_events(sequence, pitch_algorithm, durations_algorithm, symbols)
 
-    part = stream.Part()
-
-    # assert isinstance(score_tempo, tempo.MetronomeMark) and score_tempo == score.getElementsByClass(tempo.MetronomeMark)[0]
     print 'Assigned instrument', assigned_instrument
-    part.insert(0, assigned_instrument)
-
-    print 'Assigning notes and durations from numeric vectors...'
 
-    # for l in sequence:
-    step = pitch_algorithm['n_nucleotides']
-    window = durations_algorithm['window_size']
+    print('Inserting part on score', len(events))
+    score.append(PartEvents(events, assigned_instrument))
+    print('Done')
 
-    # TODO: make method
-    # splitting by window value
-    length = len(sequence)
-    split_seq_len = int(length / window) if length % window == 0 else int(length / window) + 1
-    split_sequence = np.zeros((split_seq_len, window), dtype="S1")
+    return events
 
-    for i in range(0, split_seq_len):
-        subseq = sequence[i * window: i * window + window]
-        split_sequence[i][: len(subseq)] = subseq
-        split_sequence[len(subseq):] = ''
 
-    sequence = split_sequence
+# aux function
+# pool worker: note events of one row; only the row codes of the piece are sent to workers
+def gen_row_events(args):
 
-    # splitting in n-nucleotides
-    n_nucleotide_split_len = window / step if window % step == 0 else window / step + 1
-    # print 'split seq len', split_seq_len, 'n_nucleotide split len', n_nucleotide_split_len
-    split_sequence = np.zeros((split_seq_len, np.int(n_nucleotide_split_len)), dtype="S" + str(step))
+    codes, pitch_algorithm, durations_algorithm, symbols = args
+    return gen_note_events(codes, pitch_algorithm, durations_algorithm, symbols)
 
-    nucleotides_idx = 0
-    for i in range(0, len(sequence)):
 
-        subseq = sequence[i]
-        split_subseq = split_sequence[i]
+# score of one piece (a region of columns of the alignment, with its dynamics index):
+# parts, padding and dynamics; the regions of the piece are written to 'regions_dir'
+# if 'pool' is given, the parts are generated in it
+def gen_piece(piece, piece_idx, piece_tempo, pitch_algorithm, durations_algorithm, dynamics_algorithm, instruments,
+              dynamics_index, regions_dir, pool=None):
+    assert isinstance(piece, ColumnProfile) and isinstance(dynamics_index, DynamicsIndex)
+    assert dynamics_index.n_cols == piece.shape[1]
 
-        for j in range(0, len(subseq), step):
+    # music21 objects are only created when writing music21 outputs (see ScoreEvents)
+    score = ScoreEvents(piece_tempo, pitch_algorithm['scale'])
 
-            for k in range(j, j + step):
-                split_subseq[nucleotides_idx] += subseq[k]
+    print 'Generating pitches and durations...'
 
-            nucleotides_idx += 1
+    subsequence = piece.decode()
 
-        nucleotides_idx = 0
+    regions_file_path = regions_dir + '/' + 'regions_' + str(piece_idx) + '.txt'
+    regions_file = open(regions_file_path, 'wr')
 
-    sequence = split_sequence
+    # rows in order; pool.map keeps the order of its inputs
+    rows_events = [None] * piece.shape[0]
+    if pool is not None:
+        rows_events = pool.map(gen_row_events, [(piece.codes[i], pitch_algorithm, durations_algorithm,
+                                                 piece.symbols) for i in range(0, piece.shape[0])])
 
-    #print 'Shapes', sequence.shape[0], sequence.shape[1]
-    symbols = ''
-    for i in range(0, len(sequence)):
+    for i in range(0, piece.shape[0]):
+        regions_file.write(''.join(subsequence[i]) + '\n')
+        gen_stream(score, piece.codes[i], pitch_algorithm, durations_algorithm, instruments[i],
+                   symbols=piece.symbols, events=rows_events[i])
 
-        subseq = sequence[i]
+    print 'Checking if parts have the same total duration...'
 
-        for symbol in subseq:
+    # aligning part durations (score or midi cannot be produced with unequal duration parts)
+    highest_time = score.highest_time
 
-            if symbol == '': continue
+    for part in score.parts:
 
-            pitch = dv[symbol].next()
-            d = durations.next()
+        # obtaining highest duration from all parts
+        # and aligning with it
+        part_time = part.highest_time
+        rests = padding_durations(highest_time - part_time)
 
-            symbols += symbol
-            # if symbol == '-': print 'hey', set(symbol)
-            if list(set(symbol)) != ['-']:
+        if len(rests) > 0:
+            part.events = np.append(part.events, gen_rest_events(rests))
 
-                if pitch_algorithm['algorithm'] == PitchAlgorithm.WORD_DISTANCES:
+            # a remainder shorter than MIN_TEMPO makes this part the longest one
+            highest_time = max(highest_time, part_time + np.sum(rests))
 
-                    n = pitch % scale_len
-                    # n = s.getPitches()[n]
-                    n = s[n]
-                    n = note.Note(n)
+    dynamics_vector = gen_dynamics_vector(piece, dynamics_algorithm, index=dynamics_index)
 
-                else:
+    volumes = dynamics_vector['vol']
+    print 'VOLUMES', dynamics_vector
+    window_size = dynamics_algorithm['window_size']
 
-                    frac = 1.0 / len(scale)
+    score = add_dynamics_to_score(volumes, score, window_size, instruments)
 
-                    for i in range(0, len(scale)):
-                        val = i * frac
+    print 'Dynamics to score'
 
-                        if pitch == val:
-                            n = s[i]
-                            n = note.Note(n)
+    regions_file.write('\n\nTempo: ' + str(piece_tempo))
+    regions_file.close()
 
-                n.duration = duration.Duration(d)
+    return score
 
-            else:
-                n = note.Rest()
-                n.duration = duration.Duration(d)
 
-                n.addLyric(symbol)
+# aux function
+# pool worker: score of one piece (see gen_piece)
+def gen_piece_task(args):
+    return gen_piece(*args)
 
-                assert isinstance(n, Music21Object)
 
-            part.append(n)
+# scores of all pieces of the alignment, in order (see iter_song)
+def gen_song(pitch_algorithm, durations_algorithm, dynamics_algorithm, alignment, instruments, k_shingles,
+             piece_length=5000, workers=None, parallel='rows'):
 
-    print('Inserting part on score', len(part))
-    score.insert(0, part)
-    print('Done')
+    # parte estatistica e output de ficheiros para @FileWriter
+    # retornar score, utilizar dynamics_algorithm, adicionar volumes a score e analisar score
+    return list(iter_song(pitch_algorithm, durations_algorithm, dynamics_algorithm, alignment, instruments,
+                          k_shingles, piece_length=piece_length, workers=workers, parallel=parallel))
 
 
-def gen_song(pitch_algorithm, durations_algorithm, dynamics_algorithm, alignment, instruments, k_shingles,
-             piece_length=5000):
+# yields the score of each piece as soon as it is built, so that only one piece
+# is held in memory at a time ('rows'), or at most 2 per worker ('pieces')
+# 'workers' > 1 generates the song in a pool of processes, either
+# the parts of each piece ('rows') or whole pieces at once ('pieces')
+def iter_song(pitch_algorithm, durations_algorithm, dynamics_algorithm, alignment, instruments, k_shingles,
+              piece_length=5000, workers=None, parallel='rows'):
     ####### ALIGNMENT HANDLING ##############
     assert (alignment is not None), 'No MSA provided'
 
-    assert isinstance(alignment, MultipleSeqAlignment) or \
+    assert isinstance(alignment, MultipleSeqAlignment) or isinstance(alignment, ColumnProfile) or \
            (isinstance(alignment, str) and os.path.isfile(alignment)) or \
            (isinstance(alignment, np.ndarray) and len(alignment.shape) == 2)
 
     if isinstance(alignment, str):
         print 'Reading alignment...'
-        aln_file = AlignIO.read(open(alignment, 'rU'), 'clustal')
-        aln_file = msa_to_phylip(aln_file)
 
-        print 'Opening phylip file...'
-        alignment = AlignIO.read(open(aln_file.split('.')[0] + ".phy"), 'phylip-relaxed')
+        # clustal files are parsed once; later runs memory-map their binary cache
+        alignment, _ = load_alignment(alignment, 'clustal')
 
     assert isinstance(piece_length, int) or isinstance(piece_length, float)  # and piece_length > 60
 
     # piece_length for now is only referring to number of musical elements
     # n_pieces = len(alignment[0]) / (step * piece_length)
-    scores = []
-    if not isinstance(alignment, np.ndarray):
-        alignment = np.array([[y for y in x] for x in alignment])
+
+    # every stage reads the alignment from the same column profile
+    if not isinstance(alignment, ColumnProfile):
+        alignment = ColumnProfile(alignment)
 
     # k = np.random.choice(np.arange(3, 7), 1)[0] # random number between 3 and 6; used for k-shingling
     print 'K =', k_shingles
@@ -636,10 +439,19 @@ def gen_song(pitch_algorithm, durations_algorithm, dynamics_algorithm, alignment
         if alignment.shape[1] % piece_length == 0 \
         else int(alignment.shape[1] / piece_length) + 1
 
-    split_alignment = np.array_split(alignment, split_len, axis=1)
+    split_alignment = alignment.split(split_len)
 
-    sim = SimHandler(split_alignment, k=k_shingles)
-    clusters = sim.cluster_by_similarites()
+    # signatures only depend on the pieces, so reruns of an alignment reuse them
+    sim = SimHandler(split_alignment, k=k_shingles, cache_dir=GLOBALS['SIGNATURES_DIR'])
+
+    # all-pairs clustering becomes too expensive for many pieces; from LSH_MIN_PIECES,
+    # clusters are instead the pieces linked by an estimated similarity of at least
+    # core.music.lsh.DEFAULT_THRESHOLD (not a cut of the hierarchical tree), so the
+    # number of clusters (and tempos) is comparable but not the same
+    if len(split_alignment) >= LSH_MIN_PIECES:
+        clusters = sim.cluster_by_lsh()
+    else:
+        clusters = sim.cluster_by_similarites()
 
     print('Clusters', clusters)
     tempos = np.arange(45, 160, (160 - 45) / len(clusters))
@@ -647,90 +459,59 @@ def gen_song(pitch_algorithm, durations_algorithm, dynamics_algorithm, alignment
 
     assert len(tempos_vector) == len(clusters) == len(split_alignment)
 
-    piece_idx = 0
-
-    for p in range(0, alignment.shape[1], piece_length):
-
-        if alignment.shape[1] - p < piece_length:
-            piece_length = alignment.shape[1] - p
-
-        score = stream.Score()
-
-        score_tempo = tempo.MetronomeMark('tempo', tempos_vector[piece_idx])
-
-        # print 'SCORE TEMPO', score_tempo._number
-        score.insert(0, score_tempo)
-
-        print 'Generating pitches and durations...'
-
-        subsequence = alignment[:, p: p + piece_length]
+    # column entropies and gaps are computed once for the whole alignment
+    gap_column_threshold = dynamics_algorithm['gap_column_threshold'] \
+        if 'gap_column_threshold' in dynamics_algorithm.keys() \
+        else 0.7
 
-        regions_file_path = 'regions_' + str(piece_idx) + '.txt'
+    dynamics_index = get_dynamics_index(alignment, gap_column_threshold, dynamics_algorithm['algorithm'])
 
-        if not os.path.isdir(GLOBALS['REGIONS_DIR']):
-            os.mkdir(GLOBALS['REGIONS_DIR'])
+    assert workers is None or (isinstance(workers, int) and workers > 0), 'Invalid number of workers'
+    assert parallel in ['rows', 'pieces'], 'Invalid parallelism ' + str(parallel)
 
-        if not 'DIR' in os.environ.keys(): os.environ['DIR'] = 'default'
-        if not os.path.isdir(GLOBALS['REGIONS_DIR'] + '/' + os.environ['DIR']):
-            os.mkdir(GLOBALS['REGIONS_DIR'] + '/' + os.environ['DIR'])
+    if not os.path.isdir(GLOBALS['REGIONS_DIR']):
+        os.mkdir(GLOBALS['REGIONS_DIR'])
 
-        regions_file_path = GLOBALS['REGIONS_DIR'] + '/' + os.environ['DIR'] + '/' + regions_file_path
-        regions_file = open(regions_file_path, 'wr')
+    if not 'DIR' in os.environ.keys(): os.environ['DIR'] = 'default'
+    if not os.path.isdir(GLOBALS['REGIONS_DIR'] + '/' + os.environ['DIR']):
+        os.mkdir(GLOBALS['REGIONS_DIR'] + '/' + os.environ['DIR'])
 
-        for i in range(0, alignment.shape[0]):
-            regions_file.write(''.join(subsequence[i]) + '\n')
-            gen_stream(score, subsequence[i], pitch_algorithm, durations_algorithm, instruments[i])
+    regions_dir = GLOBALS['REGIONS_DIR'] + '/' + os.environ['DIR']
 
-        print 'Checking if parts have the same total duration...'
+    # every task only holds the columns of its piece
+    tasks = ((alignment[p: p + piece_length], piece_idx, tempos_vector[piece_idx], pitch_algorithm,
+              durations_algorithm, dynamics_algorithm, instruments, dynamics_index[p: p + piece_length], regions_dir)
+             for piece_idx, p in enumerate(range(0, alignment.shape[1], piece_length)))
 
-        # aligning part durations (score or midi cannot be produced with unequal duration parts)
-        for part in score.parts:
+    pool = multiprocessing.Pool(workers) if workers is not None and workers > 1 else None
 
-            # obtaining highest duration from all parts
-            # and aligning with it
-            diff = score.highestTime - part.highestTime
+    try:
+        if pool is None:
+            for task in tasks:
+                yield gen_piece(*task)
 
-            if diff > 0:
+        elif parallel == 'pieces':
+            # sliding window of 2 pieces per worker: a new piece is queued as soon as the
+            # oldest one is returned, so workers are not idle while scores come out in order
+            pending = collections.deque(pool.apply_async(gen_piece_task, (task,))
+                                        for task in itertools.islice(tasks, 2 * workers))
 
-                while round(diff, 5) > 0:
+            while pending:
+                score = pending.popleft().get()
 
-                    # minimum = duration.Duration('2048th')
-                    n = note.Rest()
+                for task in itertools.islice(tasks, 1):
+                    pending.append(pool.apply_async(gen_piece_task, (task,)))
 
-                    if diff >= float(0.5):
-                        n.duration = duration.Duration(0.5)
-                    else:
-                        if diff >= MIN_TEMPO:
-                            n.duration = duration.Duration(diff)
-                        else:
-                            n.duration = duration.Duration(MIN_TEMPO)
+                yield score
 
-                    assert n.duration.quarterLength >= MIN_TEMPO
-
-                    part.append(n)
-                    diff = score.highestTime - part.highestTime
-
-        dynamics_vector = gen_dynamics_vector(subsequence, dynamics_algorithm)
-
-        volumes = dynamics_vector['vol']
-        print 'VOLUMES', dynamics_vector
-        window_size = dynamics_algorithm['window_size']
-
-        score = add_dynamics_to_score(volumes, score, window_size, instruments)
-
-        print 'Dynamics to score'
-        """for part in new_score:
-            elems = ''
-            for y in range(2, len(part)):
-                elems += str(part[y].volume) + ' '
-            print elems
-        sys.exit(1)"""""
-        scores.append(score)
-
-        regions_file.write('\n\nTempo: ' + str(tempos_vector[piece_idx]))
-        regions_file.close()
+        else:
+            for task in tasks:
+                yield gen_piece(*(task + (pool,)))
 
-        piece_idx += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     """print similarities_df
 
@@ -748,10 +529,6 @@ def gen_song(pitch_algorithm, durations_algorithm, dynamics_algorithm, alignment
 
     similarities_df = similarities_df.sort_values('idx')"""
 
-    # parte estatistica e output de ficheiros para @FileWriter
-    # retornar score, utilizar dynamics_algorithm, adicionar volumes a score e analisar score
-    return scores
-
 """""""""
 if __name__ == "__main__":
     from config import CURR_DIR
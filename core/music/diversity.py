@@ -0,0 +1,92 @@
+"""
+    Diversity indices of alignment columns, computed for all columns at once
+    from a (columns x symbols) count matrix
+"""
+
+import numpy as np
+from scipy.special import entr
+
+from algorithms import DynamicsAlgorithm
+
+
+# aux function
+# relative frequencies of each symbol per column, excluding gaps unless 'with_gaps'
+# normalized twice, as scipy.stats.entropy did per column
+def column_frequencies(counts, gap_code, with_gaps=False):
+
+    if not with_gaps:
+        counts = np.delete(counts, gap_code, axis=1)
+
+    counts = counts.astype(np.float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frequencies = counts / np.sum(counts, axis=1)[:, np.newaxis]
+        frequencies /= np.sum(frequencies, axis=1)[:, np.newaxis]
+
+    # empty columns have no diversity
+    frequencies[np.isnan(frequencies)] = 0
+
+    return frequencies
+
+
+# Shannon entropy (base 2) of the column symbols, gaps excluded
+def shannon_index(counts, gap_code):
+    return np.sum(entr(column_frequencies(counts, gap_code)), axis=1) / np.log(2)
+
+
+# Simpson index (probability of two random symbols being equal), gaps excluded
+def simpson_index(counts, gap_code):
+    return np.sum(column_frequencies(counts, gap_code) ** 2, axis=1)
+
+
+# Gini-Simpson index (probability of two random symbols being different), gaps excluded
+def gini_simpson_index(counts, gap_code):
+
+    frequencies = column_frequencies(counts, gap_code)
+    index = 1 - np.sum(frequencies ** 2, axis=1)
+
+    index[np.sum(frequencies, axis=1) == 0] = 0
+    return index
+
+
+# Shannon entropy (base 2) treating gaps as one more symbol
+def gap_entropy(counts, gap_code):
+    return np.sum(entr(column_frequencies(counts, gap_code, with_gaps=True)), axis=1) / np.log(2)
+
+
+# dynamics algorithm -> kernel; each kernel maps a (columns x symbols)
+# count matrix and the gap column to a vector with one value per column
+DIVERSITY_INDICES = {
+    DynamicsAlgorithm.SHANNON_INDEX: shannon_index,
+    DynamicsAlgorithm.SIMPSON_INDEX: simpson_index,
+    DynamicsAlgorithm.GINI_SIMPSON_INDEX: gini_simpson_index,
+    DynamicsAlgorithm.GAP_ENTROPY: gap_entropy
+}
+
+
+# value of the columns with too many gaps (see DynamicsIndex), meaning no diversity
+# for each kernel: 0 for entropies and Gini-Simpson, 1 for Simpson (a dominance index);
+# None keeps the kernel value, as gap entropy exists to score gapped columns
+GAPPED_COLUMN_VALUES = {
+    DynamicsAlgorithm.SHANNON_INDEX: 0.0,
+    DynamicsAlgorithm.SIMPSON_INDEX: 1.0,
+    DynamicsAlgorithm.GINI_SIMPSON_INDEX: 0.0,
+    DynamicsAlgorithm.GAP_ENTROPY: None
+}
+
+
+# computes several diversity indices over the same count matrix
+# returns a structured array with one field per index
+def gen_diversity_indices(counts, gap_code, algorithms=None):
+
+    if algorithms is None:
+        algorithms = sorted(DIVERSITY_INDICES.keys())
+
+    assert all(a in DIVERSITY_INDICES for a in algorithms), 'Unsupported diversity index in ' + str(algorithms)
+
+    indices = np.zeros((len(counts),), dtype=[(str(a), np.float) for a in algorithms])
+
+    for a in algorithms:
+        indices[a] = DIVERSITY_INDICES[a](counts, gap_code)
+
+    return indices
@@ -0,0 +1,84 @@
+"""
+    Durations of n-nucleotide words for every DurationsAlgorithm,
+    computed for all windows of a sequence at once
+"""
+
+import numpy as np
+from music21 import duration
+
+from algorithms import DurationsAlgorithm
+from config import MIN_TEMPO
+
+
+# aux function
+# quarter lengths of a vector of duration labels
+def quarter_lengths(labels):
+    return np.array([float(duration.Duration(label).quarterLength) for label in labels])
+
+
+# frequencies_discrete: a word takes the duration of the first
+# frequency threshold above its relative frequency within the window
+DISCRETE_THRESHOLDS = np.array([0.0, 0.125, 0.25, 0.375, 0.5, 1.0])
+DISCRETE_DURATIONS = quarter_lengths(['32nd', '16th', 'eighth', 'quarter', 'half', 'whole'])
+DISCRETE_DEFAULT = quarter_lengths(['32nd'])[0]
+
+# word_distances: a word takes the duration indexed by the distance
+# to its previous occurrence (modulo the number of labels)
+DISTANCE_DURATIONS = quarter_lengths(['64th', '32nd', '16th', 'eighth', 'quarter', 'half', 'whole'])
+DISTANCE_DEFAULT = quarter_lengths(['eighth'])[0]
+
+
+# returns a (windows x words per window) array with the duration (quarter length)
+# of each word; empty slots have no duration
+#   words: word ids per window (-1 for empty slots), see core.music.tokenizer
+#   counts: occurrences of each word within its window
+#   previous_distances: distance of each word to its previous occurrence
+def gen_durations(d_algorithm, words, counts, previous_distances, window_duration):
+
+    is_word = words >= 0
+    words_per_window = words.shape[1]
+
+    # duration biased with discrete attributions
+    if d_algorithm == DurationsAlgorithm.FREQUENCIES_DISCRETE:
+
+        frequencies = counts / float(words_per_window)
+        labels = np.searchsorted(DISCRETE_THRESHOLDS, frequencies, side='right')
+
+        durations = np.append(DISCRETE_DURATIONS, DISCRETE_DEFAULT)[labels]
+
+    # frequency-biased algorithm
+    elif d_algorithm == DurationsAlgorithm.FREQUENCIES_DYNAMIC:
+
+        # (empty slots are counted, as in the word frequencies)
+        counts_sum = np.sum(counts, axis=1)
+        assert np.all(counts_sum > 0), 'Inconsistent values for counts of characters in region'
+
+        durations = float(window_duration) * counts.astype(np.float) / counts_sum[:, np.newaxis].astype(np.float)
+        durations = np.maximum(durations, MIN_TEMPO)
+
+    elif d_algorithm == DurationsAlgorithm.WORD_DISTANCES:
+
+        durations = DISTANCE_DURATIONS[previous_distances % len(DISTANCE_DURATIONS)]
+        durations[previous_distances <= 0] = DISTANCE_DEFAULT
+
+    else:
+        print 'Invalid mapping introduced: ', d_algorithm
+        raise NotImplementedError
+
+    durations = np.where(is_word, durations, 0.0)
+
+    # rescaling each window to 'window_duration'
+    if d_algorithm == DurationsAlgorithm.FREQUENCIES_DISCRETE or d_algorithm == DurationsAlgorithm.WORD_DISTANCES:
+
+        total_time = np.sum(durations, axis=1)
+
+        to_rescale = np.round(total_time, 5) != round(float(window_duration), 5)
+        ratio = float(window_duration) / total_time[to_rescale]
+
+        durations[to_rescale] *= ratio[:, np.newaxis]
+
+        assert np.all(durations[is_word] >= MIN_TEMPO), \
+            'Higher tempo required for each subsequence; too short duration was calculated: ' + \
+            str(np.min(durations[is_word]))
+
+    return durations
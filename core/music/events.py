@@ -0,0 +1,218 @@
+"""
+    Note events: compact array representation of the notes generated from a sequence
+"""
+
+import numpy as np
+from music21 import note, stream, tempo
+from music21.common import opFrac
+
+from algorithms import PitchAlgorithm, DurationsAlgorithm
+from config import MIN_TEMPO
+from core.music.tokenizer import encode_sequence, tokenize, window_word_counts, word_distances
+from core.music.durations import gen_durations
+
+
+# one note (or rest) per n-nucleotide word:
+#   pitch: degree of the note in the pitch algorithm's scale
+#   quarterLength: duration of the note
+#   rest: True if the word is only made of gaps
+#   column: column of the sequence where the word starts (-1 for added rests)
+#   volume: velocity scalar of the note (0 if not assigned)
+#   length: number of symbols of the word
+NOTE_EVENT = np.dtype([('pitch', np.int16), ('quarterLength', np.float64), ('rest', np.bool), ('column', np.int32),
+                       ('volume', np.float32), ('length', np.uint8)])
+
+
+# aux function
+# note events for rests of the given durations
+def gen_rest_events(durations):
+
+    events = np.zeros((len(durations),), dtype=NOTE_EVENT)
+
+    events['quarterLength'] = durations
+    events['rest'] = True
+    events['column'] = -1
+
+    return events
+
+
+# aux function
+# durations of the rests that pad a part by 'diff' quarter lengths: as many half
+# quarters as fit and the remainder, which is never shorter than MIN_TEMPO
+# (so a part may be padded slightly past 'diff')
+def padding_durations(diff, max_rest=0.5):
+
+    if round(diff, 5) <= 0:
+        return np.zeros((0,))
+
+    n_rests = int(diff // max_rest)
+    remainder = diff - n_rests * max_rest
+
+    durations = np.full((n_rests,), max_rest)
+
+    if round(remainder, 5) > 0:
+        durations = np.append(durations, max(remainder, MIN_TEMPO))
+
+    assert np.all(durations >= MIN_TEMPO)
+    return durations
+
+
+# notes of a part, kept as note events until music21 objects are needed
+class PartEvents(object):
+
+    __slots__ = ['events', 'instrument']
+
+    def __init__(self, events, assigned_instrument):
+        assert isinstance(events, np.ndarray) and events.dtype == NOTE_EVENT
+
+        self.events = events
+        self.instrument = assigned_instrument
+
+    def __len__(self):
+        return len(self.events)
+
+    @property
+    def highest_time(self):
+        return float(np.sum(self.events['quarterLength']))
+
+
+# lightweight score: parts of note events, the score tempo and the scale
+# used for pitches; music21 objects are only created by to_music21
+class ScoreEvents(object):
+
+    __slots__ = ['parts', 'tempo', 'scale']
+
+    def __init__(self, score_tempo, scale):
+        assert isinstance(scale, list) and len(scale) > 1
+
+        self.parts = []
+        self.tempo = score_tempo
+        self.scale = scale
+
+    def append(self, part):
+        assert isinstance(part, PartEvents)
+        self.parts.append(part)
+
+    @property
+    def highest_time(self):
+        return max(part.highest_time for part in self.parts) if self.parts else 0.0
+
+    # quarter lengths of a duration in seconds, at the score tempo
+    def seconds_to_quarter_length(self, seconds):
+        return seconds * self.tempo / 60.0
+
+    # builds the music21 score (only needed for music21 outputs)
+    def to_music21(self):
+
+        score = stream.Score()
+        score_tempo = tempo.MetronomeMark('tempo', self.tempo)
+
+        for part_events in self.parts:
+            score.insert(0, self.__build_part__(part_events, score_tempo))
+
+        return score
+
+    # builds a music21 part in bulk: offsets are the cumulative durations and
+    # elements are inserted without per-element sorting or checks
+    def __build_part__(self, part_events, score_tempo):
+
+        events = part_events.events
+        quarter_lengths = events['quarterLength']
+
+        offsets = np.cumsum(quarter_lengths) - quarter_lengths
+
+        part = stream.Part()
+        part.coreInsert(0, score_tempo)
+        part.coreInsert(0, part_events.instrument)
+
+        for e, offset in zip(events.tolist(), offsets.tolist()):
+
+            pitch_idx, quarter_length, is_rest, _, volume, length = e
+
+            if not is_rest:
+
+                n = note.Note(self.scale[pitch_idx], quarterLength=quarter_length)
+
+                if volume > 0:
+                    n.volume = volume
+
+            else:
+                n = note.Rest(quarterLength=quarter_length)
+
+                if length > 0:
+                    n.lyrics.append(note.Lyric('-' * length))
+
+            part.coreInsert(opFrac(offset), n, ignoreSort=True)
+
+        part.coreElementsChanged()
+        return part
+
+
+# splits a sequence in windows of n-nucleotide words (once) and
+# maps them to pitches and durations, returning one note event per word
+# 'sequence' is a row of symbols or, if 'symbols' is given, a row of codes of that alphabet
+def gen_note_events(sequence, pitch_algorithm, durations_algorithm, symbols=None):
+    assert isinstance(pitch_algorithm, PitchAlgorithm) and isinstance(durations_algorithm, DurationsAlgorithm)
+    assert sequence is not None
+
+    step = 1
+    window = 1500
+    window_duration = 8
+
+    for key in durations_algorithm.keys():
+        if key == 'n_nucleotides':
+            step = durations_algorithm['n_nucleotides']
+            assert isinstance(step, int) and step > 0
+
+        elif key == 'window_size':
+            window = durations_algorithm['window_size']
+            assert isinstance(window, int) and window > 0
+
+        elif key == 'window_duration':
+            window_duration = durations_algorithm['window_duration']
+            assert (isinstance(window_duration, float) or isinstance(window_duration, int)) and window > 0
+
+    if 'n_nucleotides' in pitch_algorithm.keys():
+        assert step == pitch_algorithm['n_nucleotides']
+
+    d_algorithm = durations_algorithm['algorithm']
+    p_algorithm = pitch_algorithm['algorithm']
+
+    assert 'scale' in pitch_algorithm.keys()
+    scale_len = len(pitch_algorithm['scale'])
+
+    if p_algorithm != PitchAlgorithm.WORD_DISTANCES:
+        print 'Invalid mapping introduced: ', p_algorithm
+        raise NotImplementedError
+
+    # splitting in windows of n-nucleotide words
+    if symbols is None:
+        sequence, symbols = encode_sequence(sequence)
+
+    gap_code = list(symbols).index('-')
+    words, rests, lengths = tokenize(sequence, window, step, len(symbols), gap_code)
+
+    # words shape - [ [window] [window] ....]
+    # window shape - [word word ....], with -1 for empty slots
+    is_word = words >= 0
+
+    word_counts = window_word_counts(words)
+
+    # distances between occurrences of each word, for the whole sequence at once
+    previous_distances, following_distances = word_distances(words)
+
+    durations = gen_durations(d_algorithm, words, word_counts, previous_distances, window_duration)
+
+    # first column of each word
+    columns = np.arange(words.shape[0])[:, np.newaxis] * window + np.arange(words.shape[1]) * step
+
+    events = np.zeros((np.count_nonzero(is_word),), dtype=NOTE_EVENT)
+
+    # each word is pitched by the distance to its next occurrence
+    events['pitch'] = following_distances[is_word] % scale_len
+    events['quarterLength'] = durations[is_word]
+    events['rest'] = rests[is_word]
+    events['column'] = columns[is_word]
+    events['length'] = lengths[is_word]
+
+    return events
@@ -0,0 +1,74 @@
+"""
+    Locality-sensitive hashing (banding) of MinHash signatures: pieces sharing
+    a whole band of their signatures are candidate pairs, and the connected
+    components of the candidates with a high enough estimated similarity are
+    the clusters
+"""
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# estimated similarity from which candidates are linked; without it, chains of
+# weakly similar candidates percolate into a single cluster
+DEFAULT_THRESHOLD = 0.5
+
+# banding whose S-curve threshold, (1 / bands) ** (1 / rows) ~ 0.52, is near DEFAULT_THRESHOLD
+DEFAULT_BANDS = 25
+DEFAULT_ROWS = 5
+
+
+# aux function
+# probability of two sets with Jaccard similarity 'similarity' becoming candidates
+def candidate_probability(similarity, bands=DEFAULT_BANDS, rows=DEFAULT_ROWS):
+    return 1 - (1 - similarity ** rows) ** bands
+
+
+# candidate pairs of a (sets x num_perm) signature matrix, split in 'bands' bands of 'rows' values
+# sets in the same bucket of a band are linked as a chain (enough for connected components),
+# so the number of pairs is linear in the number of sets
+# returns two arrays (i, j) with i < j
+def candidate_pairs(signatures, bands=DEFAULT_BANDS, rows=DEFAULT_ROWS):
+
+    n_sets, num_perm = signatures.shape
+    assert bands > 0 and rows > 0 and bands * rows <= num_perm, \
+        'Invalid banding ' + str(bands) + ' x ' + str(rows) + ' for ' + str(num_perm) + ' permutations'
+
+    first, second = [], []
+
+    for b in range(0, bands):
+
+        band = signatures[:, b * rows: (b + 1) * rows]
+
+        # sets sorted by band values; equal neighbours share a bucket
+        order = np.lexsort(band.T[::-1])
+        same_bucket = np.all(band[order[1:]] == band[order[:-1]], axis=1)
+
+        first.append(order[:-1][same_bucket])
+        second.append(order[1:][same_bucket])
+
+    first, second = np.concatenate(first).astype(np.int64), np.concatenate(second).astype(np.int64)
+
+    # unique pairs with i < j
+    pairs = np.unique(np.minimum(first, second) * n_sets + np.maximum(first, second))
+
+    return pairs // n_sets, pairs % n_sets
+
+
+# fcluster-style labels (1 to n_clusters) of the sets of a signature matrix:
+# connected components of the candidate pairs with an estimated similarity of
+# at least 'threshold' (all candidates are linked if it is None)
+def lsh_clusters(signatures, bands=DEFAULT_BANDS, rows=DEFAULT_ROWS, threshold=DEFAULT_THRESHOLD):
+
+    n_sets = len(signatures)
+
+    i, j = candidate_pairs(signatures, bands, rows)
+
+    if threshold is not None:
+        similarities = np.sum(signatures[i] == signatures[j], axis=1) / float(signatures.shape[1])
+        i, j = i[similarities >= threshold], j[similarities >= threshold]
+
+    graph = coo_matrix((np.ones(len(i), dtype=np.int8), (i, j)), shape=(n_sets, n_sets))
+    _, labels = connected_components(graph, directed=False)
+
+    return labels + 1
@@ -0,0 +1,114 @@
+"""
+    Batched MinHash signatures of integer shingle sets, with the same
+    universal hash permutations as datasketch.MinHash
+"""
+
+import numpy as np
+
+# http://en.wikipedia.org/wiki/Mersenne_prime
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+# identifies how signatures are computed (base hash and permutations);
+# it names cached signatures, so it must change whenever either does
+SIGNATURE_SCHEME = 'splitmix64-mersenne61-v1'
+
+# shingles hashed per block (bounds the (shingles x permutations) temporary matrix)
+CHUNK_SIZE = 4096
+
+# signature values compared per block of pairs
+PAIRS_BLOCK_SIZE = 1 << 24
+
+
+# (a, b) parameters of 'num_perm' permutations of 32-bit hash values,
+# drawn as datasketch does for the same seed
+def gen_permutations(num_perm, seed=1):
+
+    generator = np.random.RandomState(seed)
+
+    permutations = np.array([(generator.randint(1, MERSENNE_PRIME, dtype=np.uint64),
+                              generator.randint(0, MERSENNE_PRIME, dtype=np.uint64))
+                             for _ in range(num_perm)], dtype=np.uint64).T
+
+    return permutations[0], permutations[1]
+
+
+# 32-bit hash values of uint64 ids (splitmix64 finalizer, upper half)
+def hash32(ids):
+
+    z = np.array(ids, dtype=np.uint64)
+
+    with np.errstate(over='ignore'):
+        z ^= z >> np.uint64(30)
+        z *= np.uint64(0xbf58476d1ce4e5b9)
+        z ^= z >> np.uint64(27)
+        z *= np.uint64(0x94d049bb133111eb)
+        z ^= z >> np.uint64(31)
+
+    return z >> np.uint64(32)
+
+
+# MinHash signature (num_perm uint64 values) of a set of shingle ids
+# an empty set has every value at MAX_HASH, as a new datasketch.MinHash
+def minhash_signature(shingles, permutations, chunk_size=CHUNK_SIZE):
+
+    a, b = permutations
+
+    signature = np.full((len(a),), MAX_HASH, dtype=np.uint64)
+    hash_values = hash32(np.unique(shingles))
+
+    for i in range(0, len(hash_values), chunk_size):
+
+        hv = hash_values[i: i + chunk_size, np.newaxis]
+
+        # (a * hv + b) wraps modulo 2^64, as in datasketch
+        with np.errstate(over='ignore'):
+            phv = np.bitwise_and((a * hv + b) % MERSENNE_PRIME, MAX_HASH)
+
+        signature = np.minimum(signature, np.min(phv, axis=0))
+
+    return signature
+
+
+# (sets x num_perm) matrix with the MinHash signature of each set of shingle ids
+# 'shingle_sets' may be a generator, so that only one set is held at a time
+def gen_signatures(shingle_sets, num_perm=128, seed=1):
+
+    permutations = gen_permutations(num_perm, seed)
+
+    signatures = [minhash_signature(shingles, permutations) for shingles in shingle_sets]
+
+    return np.array(signatures, dtype=np.uint64).reshape((len(signatures), num_perm))
+
+
+# Jaccard similarities estimated between all pairs of signatures (rows of a
+# (sets x num_perm) matrix), only for i < j, in the order of a condensed distance
+# matrix (see scipy.spatial.distance.squareform); rows are compared in blocks
+# the result still holds n (n - 1) / 2 values (float32, as estimates are only accurate
+# to about 1 / sqrt(num_perm)), so from core.music.LSH_MIN_PIECES pieces callers
+# must cluster with the LSH index instead (see core.music.lsh)
+def pairwise_similarities(signatures, block_size=PAIRS_BLOCK_SIZE):
+
+    n_sets, num_perm = signatures.shape
+
+    similarities = np.empty((n_sets * (n_sets - 1) // 2,), dtype=np.float32)
+
+    # rows per block so that at most 'block_size' values are compared at once
+    n_block_rows = max(1, block_size // max(1, n_sets * num_perm))
+
+    idx = 0
+    for start in range(0, n_sets - 1, n_block_rows):
+
+        stop = min(start + n_block_rows, n_sets - 1)
+
+        # rows [start, stop) against rows (start, n_sets)
+        matches = np.sum(signatures[start: stop, np.newaxis] == signatures[np.newaxis, start + 1:], axis=2)
+
+        for i in range(start, stop):
+            row = matches[i - start, i - start:]
+
+            similarities[idx: idx + len(row)] = row / float(num_perm)
+            idx += len(row)
+
+    assert idx == len(similarities)
+    return similarities
@@ -2,8 +2,17 @@
     Library to handle MinHash/LSH similarity estimation techniques
 """
 
+import errno
+import hashlib
+import os
+import tempfile
+
 import numpy as np
-import datasketch as dk  # MinHash signatures library
+
+from core.columns import ColumnProfile
+from core.encoding import SYMBOLS
+from core.music.minhash import gen_signatures, pairwise_similarities, SIGNATURE_SCHEME
+from core.music.lsh import lsh_clusters, DEFAULT_BANDS, DEFAULT_ROWS, DEFAULT_THRESHOLD
 
 # import pandas as pd
 
@@ -14,121 +23,274 @@ from Bio.Align import MultipleSeqAlignment
 from Bio import AlignIO"""
 
 
+# code used for the surplus characters of the last piece (not used by any symbol)
+PADDING_CODE = len(SYMBOLS)
+
+# shingles are numbers in this base, one digit per symbol code
+SHINGLE_BASE = len(SYMBOLS) + 1
+
+# seed of the MinHash permutations of the pieces
+SIGNATURE_SEED = 1
+
+
+# backends of the piece similarities: exact Jaccard of the shingle sets,
+# MinHash estimates, or exact Jaccard only while it is cheap ('auto')
+BACKENDS = ['auto', 'exact', 'minhash']
+
+# shingles compared over all pairs of pieces up to which 'auto' uses exact Jaccard
+EXACT_MAX_COMPARISONS = 1 << 22
+
+
+# uint64 id of every k-shingle of each row of 'sequences' (rows x symbols codes),
+# the base-SHINGLE_BASE number of its k codes; returns a (rows x shingles) matrix
+def shingle_ids(sequences, k):
+    assert k * np.log2(SHINGLE_BASE) < 64, 'Shingles too long for 64 bits: ' + str(k)
+
+    sequences = np.asarray(sequences, dtype=np.uint64)
+    n_shingles = sequences.shape[1] - k + 1
+
+    ids = np.zeros((sequences.shape[0], n_shingles), dtype=np.uint64)
+
+    # rolling (Horner) evaluation over the k positions of every shingle at once
+    for j in range(0, k):
+        ids = ids * np.uint64(SHINGLE_BASE) + sequences[:, j: j + n_shingles]
+
+    return ids
+
+
+# exact Jaccard similarity of two sorted arrays of unique shingle ids
+# (two empty sets are equal, as their MinHash signatures)
+def exact_jaccard(shingles, other):
+
+    intersection = len(np.intersect1d(shingles, other, assume_unique=True))
+    union = len(shingles) + len(other) - intersection
+
+    return intersection / float(union) if union > 0 else 1.0
+
+
+# exact Jaccard similarities between all pairs of sets of sorted unique shingle ids, only
+# for i < j, in the same (condensed) order as core.music.minhash.pairwise_similarities
+def pairwise_jaccard(shingle_sets):
+
+    n_sets = len(shingle_sets)
+
+    similarities = np.empty((n_sets * (n_sets - 1) // 2,), dtype=np.float)
+
+    idx = 0
+    for i in range(0, n_sets - 1):
+        for j in range(i + 1, n_sets):
+            similarities[idx] = exact_jaccard(shingle_sets[i], shingle_sets[j])
+            idx += 1
+
+    return similarities
+
+
 # class used to implement textual similarity-based techniques
+# sets are the pieces of an alignment, as ColumnProfile views
+# (or as symbol or code matrices, which are profiled here)
+# 'backend' is one of BACKENDS (see gen_similarities)
+# signatures are kept in 'cache_dir' (see gen_signatures), if given
 class SimHandler(object):
-    def __init__(self, sets, k=2):
+    def __init__(self, sets, k=2, backend='auto', cache_dir=None):
         assert (isinstance(sets, np.ndarray) and len(sets.shape) == 3) \
-               or (isinstance(sets, list) and all(isinstance(x, np.ndarray) and len(x.shape) == 2 for x in sets))  # 3d ndarray
+               or (isinstance(sets, list) and all(isinstance(x, np.ndarray) and len(x.shape) == 2 for x in sets)) \
+               or (isinstance(sets, list) and all(isinstance(x, ColumnProfile) for x in sets))
         assert isinstance(k, int) and k > 0
+        assert backend in BACKENDS, 'Invalid similarity backend ' + str(backend)
+
+        if not isinstance(sets[0], ColumnProfile):
+            profile = ColumnProfile(np.concatenate(list(sets), axis=1))
+            bounds = np.cumsum([0] + [x.shape[1] for x in sets])
+
+            sets = [profile[bounds[i]: bounds[i + 1]] for i in range(0, len(sets))]
 
         self.k = k
         self.sets = sets
+        self.backend = backend
+        self.cache_dir = cache_dir
 
-    def cluster_by_similarites(self, threshold=0.7, num_perm=128):
+    # hierarchical clustering ('method' linkage) of the piece distances,
+    # cut at 'threshold' by fcluster 'criterion'
+    def cluster_by_similarites(self, threshold=0.7, num_perm=128, method='single', criterion='inconsistent'):
         from scipy.cluster.hierarchy import linkage, cophenet, fcluster
 
         n_pieces = len(self.sets)
-        n_rows = self.sets.shape[1] if isinstance(self.sets, np.ndarray) else len(self.sets[0])
 
-        minhashes = []
+        similarities = self.gen_similarities(num_perm)
 
-        # pieces
-        shingles_idx = 0
-        for p in range(0, n_pieces):
+        assert len(similarities) == n_pieces * (n_pieces - 1) // 2
 
-            piece = self.sets[p]
+        # upper triangle of the distances: 1 / similarity (1 for disjoint pieces)
 
-            minhash = dk.MinHash(num_perm=num_perm)
+        distances = np.ones(similarities.shape)
+        distances[similarities > 0] = 1 / similarities[similarities > 0]
 
-            n_cols = len(piece[0])
-            n_sequence = n_cols + self.k - 1
-            n_shingle_elements = n_sequence - self.k + 1
+        # condensed distances are used as they are (a square matrix would be read as observations)
+        Z = linkage(distances, method=method)  # todo: test different metrics
 
-            shingles = np.empty(n_rows * n_shingle_elements, dtype="S" + str(self.k))
+        from scipy.cluster.hierarchy import dendrogram
 
-            # iterating sequences from a region
-            for s in range(0, n_rows):
+        dendrogram(Z, show_leaf_counts=True)
 
-                # input sequence considering surplus characters
-                sequence = np.empty((n_sequence,), dtype="S1")
-                sequence[0 : n_cols] = piece[s]
+        # import matplotlib.pyplot as plt
+        # plt.show()
+        # plt.savefig('dendrogram_' + str(self.k))
 
-                if p != n_pieces - 1:  # if we aren't on the last piece:
+        return fcluster(Z, threshold, criterion=criterion)
 
-                    next_piece = self.sets[p + 1]
-                    sequence[n_cols:] = next_piece[s][0: self.k - 1]  # surplus
-                else:
+    # fcluster-style labels from an LSH banding index of the piece signatures
+    # (see core.music.lsh); cost is roughly linear in the number of pieces
+    def cluster_by_lsh(self, bands=DEFAULT_BANDS, rows=DEFAULT_ROWS, threshold=DEFAULT_THRESHOLD, num_perm=128):
+        return lsh_clusters(self.gen_signatures(num_perm), bands, rows, threshold)
 
-                    sequence[n_cols:] = 'Z'  # TODO: possivelmente substituir por valor mais provavel
+    # backend of the similarities: the chosen one or, for 'auto', exact Jaccard
+    # while all pairs of pieces compare at most EXACT_MAX_COMPARISONS shingles
+    def select_backend(self):
 
-                shingled_sequence = self.__split_into_shingles__(sequence)
-                assert len(shingled_sequence) == n_shingle_elements, \
-                    'Shingled sequence: ' + str(len(shingled_sequence)) + ' and fixed len ' + str(n_shingle_elements)
+        if self.backend != 'auto':
+            return self.backend
 
-                # print shingles_idx + n_cols
+        n_pieces = len(self.sets)
 
-                shingles[shingles_idx: shingles_idx + n_shingle_elements] = shingled_sequence
-                shingles_idx += n_shingle_elements
+        # each piece has (at most) one shingle per element
+        n_shingles = sum(piece.codes.size for piece in self.sets)
 
-            for word in shingles:
-                minhash.update(word)
+        # every piece is intersected with the other n - 1 pieces
+        comparisons = (n_pieces - 1) * n_shingles
 
-            minhashes.append(minhash)
-            shingles_idx = 0
+        return 'exact' if comparisons <= EXACT_MAX_COMPARISONS else 'minhash'
 
-        assert len(minhashes) == n_pieces
-        # print(shingles)
+    # expected error of the similarities: none for exact Jaccard,
+    # 1 / sqrt(num_perm) for MinHash estimates
+    def similarity_error(self, num_perm=128):
+        return 0.0 if self.select_backend() == 'exact' else 1 / np.sqrt(num_perm)
 
-        distance_matrix = np.empty((n_pieces, n_pieces), dtype=np.float)
+    # Jaccard similarities between all pairs of pieces, in condensed order
+    # (see core.music.minhash.pairwise_similarities), with the selected backend
+    def gen_similarities(self, num_perm=128):
 
-        for i in range(0, len(minhashes)):
-            for j in range(0, len(minhashes)):
+        backend = self.select_backend()
+        print 'Similarity backend:', backend, '(error bound', self.similarity_error(num_perm), ')'
 
-                if i == j:
-                    distance_matrix[i][j] = 0
-                else:
+        if backend == 'exact':
+            return pairwise_jaccard(self.gen_shingle_sets())
 
-                    similarity = minhashes[i].jaccard(minhashes[j])
+        return pairwise_similarities(self.gen_signatures(num_perm))
 
-                    if similarity == 0:
-                        distance_matrix[i][j] = 1
-                    else:
-                        distance_matrix[i][j] = 1 / similarity
+    # sorted unique shingle ids of each piece
+    def gen_shingle_sets(self):
+        return [np.unique(self.gen_shingles(p)) for p in range(0, len(self.sets))]
 
-        Z = linkage(distance_matrix)  # todo: test different metrics
+    # (pieces x num_perm) matrix with the MinHash signature of each piece
+    # with a cache_dir, signatures are read from (or written to) a file named
+    # after the content of the pieces (see signatures_path)
+    def gen_signatures(self, num_perm=128):
 
-        from scipy.cluster.hierarchy import dendrogram
+        cache_path = self.signatures_path(num_perm) if self.cache_dir is not None else None
 
-        dendrogram(Z, show_leaf_counts=True)
+        if cache_path is not None and os.path.isfile(cache_path):
+            signatures = self.read_signatures(cache_path)
 
-        # import matplotlib.pyplot as plt
-        # plt.show()
-        # plt.savefig('dendrogram_' + str(self.k))
+            if signatures is not None and signatures.shape == (len(self.sets), num_perm) \
+                    and signatures.dtype == np.uint64:
+                print 'Reading signatures', cache_path
+                return signatures
 
-        return fcluster(Z, 0.70)
+        signatures = gen_signatures((self.gen_shingles(p) for p in range(0, len(self.sets))), num_perm,
+                                    seed=SIGNATURE_SEED)
 
-    def __split_into_shingles__(self, sequence):
+        if cache_path is not None:
+            self.write_signatures(signatures, cache_path)
 
-        length = len(sequence)
-        if self.k < 1 or self.k > length:
-            print 'Invalid parameter k ', self.k, ' for sequence length ', length
+        return signatures
+
+    # cache file of the signatures of the pieces, named after the signature scheme
+    # and seed, the content hash of every piece and its surplus (see gen_sequences),
+    # k and num_perm
+    def signatures_path(self, num_perm=128):
+
+        key = hashlib.sha1(SIGNATURE_SCHEME + str(SIGNATURE_SEED))
+
+        for p in range(0, len(self.sets)):
+            key.update(self.sets[p].content_hash)
+
+            if p != len(self.sets) - 1:
+                key.update(np.ascontiguousarray(self.sets[p + 1].codes[:, 0: self.k - 1]).tostring())
+            else:
+                key.update(str(PADDING_CODE))
+
+        return self.cache_dir + '/' + key.hexdigest() + '_k' + str(self.k) + '_' + str(num_perm) + '.npy'
+
+    # signatures of a cache file, or None if it cannot be read
+    # (e.g. a file left incomplete by another session)
+    @staticmethod
+    def read_signatures(cache_path):
+        try:
+            return np.load(cache_path)
+        except (IOError, ValueError, EOFError):
+            print 'Ignoring unreadable signatures', cache_path
             return None
 
-        # tokenizer
-        n_shingles = length - self.k + 1  # experimental value !!
+    # writes the signatures in the cache; every session writes its own temporary
+    # file and renames it at once, as other sessions may be reading (or writing) it
+    def write_signatures(self, signatures, cache_path):
 
-        shingles = np.zeros((n_shingles,), dtype="S" + str(self.k))
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
 
-        i = 0
-        while length - i >= self.k:
+        print 'Writing signatures', cache_path
 
-            for s in sequence[i: i + self.k]:
-                shingles[i] += s
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
 
-            i += 1
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, signatures)
+
+            os.rename(tmp_path, cache_path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    # codes of all rows of piece 'p', each followed by the first k - 1
+    # symbols of the same row in the next piece (or by padding, in the last one)
+    def gen_sequences(self, p):
+
+        piece = self.sets[p].codes
+        n_rows, n_cols = piece.shape
+
+        # input sequences considering surplus characters
+        sequences = np.empty((n_rows, n_cols + self.k - 1), dtype=np.uint8)
+        sequences[:, 0: n_cols] = piece
+
+        if p != len(self.sets) - 1:  # if we aren't on the last piece:
+            sequences[:, n_cols:] = self.sets[p + 1].codes[:, 0: self.k - 1]  # surplus
+        else:
+            sequences[:, n_cols:] = PADDING_CODE  # TODO: possivelmente substituir por valor mais provavel
+
+        return sequences
+
+    # k-shingles of all rows of piece 'p' (see shingle_ids and gen_sequences)
+    def gen_shingles(self, p):
+
+        n_rows, n_cols = self.sets[p].shape
+
+        shingles = self.__split_into_shingles__(self.gen_sequences(p))
+        assert shingles.shape == (n_rows, n_cols), \
+            'Shingled sequences: ' + str(shingles.shape) + ' and fixed shape ' + str((n_rows, n_cols))
+
+        return shingles.ravel()
+
+    def __split_into_shingles__(self, sequences):
+
+        length = sequences.shape[1]
+        if self.k < 1 or self.k > length:
+            print 'Invalid parameter k ', self.k, ' for sequence length ', length
+            return None
 
-        # print shingles
-        return shingles
+        return shingle_ids(sequences, self.k)
 
     def assign_tempos_by_clusters(self, fclusters, tempo_vector):
 
@@ -0,0 +1,159 @@
+"""
+    Standard MIDI File (type 1) writer for note-event arrays,
+    laid out as music21's streamToMidiFile does (one track per part)
+"""
+
+import struct
+
+import numpy as np
+from music21 import pitch
+from music21.instrument import UnpitchedPercussion
+
+# same resolution as music21
+TICKS_PER_QUARTER = 1024
+
+# music21 starts every track one quarter late and ends it one quarter after its last note
+PADDING_QUARTERS = 1
+
+# velocity of notes without an assigned volume (music21's default)
+DEFAULT_VELOCITY = 90
+
+PERCUSSION_CHANNEL = 9
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+PROGRAM_CHANGE = 0xC0
+
+
+# aux function
+# MIDI variable length quantities of a vector of non negative integers
+# returns a (values x 4) matrix of bytes and a mask of the bytes used by each value
+def variable_length_quantities(values):
+
+    values = np.asarray(values, dtype=np.int64)
+    assert np.all(values >= 0) and np.all(values < 2 ** 28), 'Invalid delta times'
+
+    groups = (values[:, np.newaxis] >> np.array([21, 14, 7, 0])) & 0x7f
+
+    # every byte but the last one has the continuation bit set
+    groups[:, :3] |= 0x80
+
+    n_bytes = 1 + np.sum(values[:, np.newaxis] >= np.array([2 ** 7, 2 ** 14, 2 ** 21]), axis=1)
+    used = np.arange(4) >= 4 - n_bytes[:, np.newaxis]
+
+    return groups.astype(np.uint8), used
+
+
+# aux function
+# meta event at delta time 0
+def meta_event(event_type, data):
+
+    length, used = variable_length_quantities([len(data)])
+    return '\x00\xff' + chr(event_type) + length[used].tostring() + data
+
+
+# velocities (1 - 127) of a vector of velocity scalars; 0 means no volume assigned
+def velocities(volumes):
+
+    volumes = np.asarray(volumes, dtype=np.float64)
+
+    v = np.clip(np.floor(volumes * 127 + 0.5), 1, 127).astype(np.uint8)
+    v[volumes <= 0] = DEFAULT_VELOCITY
+
+    return v
+
+
+# one MTrk chunk with the notes of a part:
+#   pitches: MIDI pitch of each element (ignored for rests)
+#   quarter_lengths: duration of each element
+#   velocities: MIDI velocity of each element (ignored for rests)
+#   rests: True for rests, which only move the following notes
+def gen_track(pitches, quarter_lengths, velocities, rests, score_tempo, program=0, channel=0, name='',
+              ticks_per_quarter=TICKS_PER_QUARTER):
+
+    assert len(pitches) == len(quarter_lengths) == len(velocities) == len(rests)
+    assert 0 <= channel < 16 and 0 <= program < 128
+
+    quarter_lengths = np.asarray(quarter_lengths, dtype=np.float64)
+    rests = np.asarray(rests, dtype=np.bool)
+
+    offsets = np.cumsum(quarter_lengths) - quarter_lengths + PADDING_QUARTERS
+
+    is_note = ~rests
+    n_notes = np.count_nonzero(is_note)
+
+    # absolute times (in ticks) of note on/off pairs; offsets and durations are rounded
+    # separately, as music21 does
+    times = np.empty((2 * n_notes,), dtype=np.int64)
+    times[0::2] = np.floor(offsets[is_note] * ticks_per_quarter + 0.5)
+    times[1::2] = times[0::2] + np.floor(quarter_lengths[is_note] * ticks_per_quarter + 0.5)
+
+    messages = np.empty((2 * n_notes, 3), dtype=np.uint8)
+    messages[0::2, 0] = NOTE_ON | channel
+    messages[1::2, 0] = NOTE_OFF | channel
+    messages[:, 1] = np.repeat(np.asarray(pitches)[is_note], 2)
+    messages[0::2, 2] = np.asarray(velocities)[is_note]
+    messages[1::2, 2] = 0
+
+    # a note may end a tick after the next one starts; events are sorted by time,
+    # with note offs first at equal times
+    order = np.lexsort((messages[:, 0] & 0xf0 == NOTE_ON, times))
+    times = times[order]
+    messages = messages[order]
+
+    deltas, used = variable_length_quantities(np.diff(np.append(0, times)))
+
+    # delta time and message of every event, written at once
+    events = np.hstack((deltas, messages))[np.hstack((used, np.ones(messages.shape, dtype=np.bool)))]
+
+    # the track ends one quarter after its last event (trailing rests are not written)
+    tail, tail_used = variable_length_quantities([PADDING_QUARTERS * ticks_per_quarter])
+
+    # microseconds per quarter note
+    microseconds = int(round(60000000.0 / score_tempo))
+
+    track = meta_event(0x03, name) + \
+        '\x00' + chr(PROGRAM_CHANGE | channel) + chr(program) + \
+        meta_event(0x51, struct.pack('>I', microseconds)[1:]) + \
+        events.tostring() + \
+        tail[tail_used].tostring() + '\xff\x2f\x00'
+
+    return 'MTrk' + struct.pack('>I', len(track)) + track
+
+
+# writes an SMF type 1 file from already built tracks (see gen_track)
+def write_smf(path, tracks, ticks_per_quarter=TICKS_PER_QUARTER):
+
+    header = 'MThd' + struct.pack('>IHHH', 6, 1, len(tracks), ticks_per_quarter)
+
+    with open(path, 'wb') as f:
+        f.write(header + ''.join(tracks))
+
+
+# writes the parts of a ScoreEvents (see core.music.events) as a MIDI file
+def write_score_events(score, path):
+
+    scale_pitches = np.array([(p if isinstance(p, pitch.Pitch) else pitch.Pitch(p)).midi for p in score.scale])
+
+    # channels are assigned in part order, as music21 does; channel 10 is kept for percussion
+    channels = [c for c in range(0, 16) if c != PERCUSSION_CHANNEL]
+
+    tracks = []
+
+    for idx, part in enumerate(score.parts):
+
+        events = part.events
+        assigned_instrument = part.instrument
+
+        if isinstance(assigned_instrument, UnpitchedPercussion):
+            channel = PERCUSSION_CHANNEL
+        else:
+            channel = channels[idx % len(channels)]
+
+        program = assigned_instrument.midiProgram if assigned_instrument.midiProgram is not None else 0
+        name = assigned_instrument.instrumentName or ''
+
+        tracks.append(gen_track(scale_pitches[events['pitch']], events['quarterLength'], velocities(events['volume']),
+                                events['rest'], score.tempo, program=program, channel=channel, name=str(name)))
+
+    write_smf(path, tracks)
@@ -0,0 +1,98 @@
+"""
+    Splits an integer-coded sequence into windows of n-nucleotide words,
+    each word being the base-(n_symbols + 1) number of its symbol codes
+"""
+
+import numpy as np
+
+from core.encoding import SYMBOLS, encode
+
+
+# aux function
+# canonical codes of a sequence of symbols (string or "S1" array) and the alphabet used
+def encode_sequence(sequence):
+    return encode(sequence if isinstance(sequence, str) else np.asarray(sequence)), SYMBOLS
+
+
+# splits 'codes' in windows of 'window' symbols, and each window in words of 'step' symbols
+# returns three (windows x words per window) arrays:
+#   words: integer id of each word (-1 for the empty slots of the last window)
+#   rests: True for the words only made of gaps
+#   lengths: number of symbols in each word (the last word of a window may be shorter)
+def tokenize(codes, window, step, n_symbols, gap_code):
+    assert isinstance(window, int) and window > 0 and isinstance(step, int) and step > 0
+
+    # one extra digit marks the positions past the end of a window
+    base = n_symbols + 1
+    padding = n_symbols
+
+    assert step * np.log2(base) < 63, 'Too many nucleotides per word: ' + str(step)
+
+    length = len(codes)
+
+    n_windows = int(np.ceil(float(length) / window))
+    words_per_window = int(np.ceil(float(window) / step))
+
+    windows = np.full((n_windows * window,), padding, dtype=np.int64)
+    windows[:length] = codes
+
+    # windows padded up to a whole number of words
+    padded = np.full((n_windows, words_per_window * step), padding, dtype=np.int64)
+    padded[:, :window] = windows.reshape((n_windows, window))
+
+    # (windows, words, symbols) view of the padded windows
+    split = padded.reshape((n_windows, words_per_window, step))
+
+    words = np.dot(split, base ** np.arange(step - 1, -1, -1, dtype=np.int64))
+
+    is_symbol = split != padding
+    lengths = np.sum(is_symbol, axis=2)
+
+    rests = np.all((split == gap_code) | ~is_symbol, axis=2) & (lengths > 0)
+    words[lengths == 0] = -1
+
+    return words, rests, lengths
+
+
+# number of occurrences of each word within its window (empty slots included),
+# with the same shape as 'words'
+def window_word_counts(words):
+
+    n_windows = words.shape[0]
+
+    vocabulary, ids = np.unique(words, return_inverse=True)
+    ids = ids.reshape(words.shape)
+
+    flat = ids + np.arange(n_windows)[:, np.newaxis] * len(vocabulary)
+    counts = np.bincount(flat.ravel(), minlength=n_windows * len(vocabulary))
+
+    return counts[flat]
+
+
+# distances (in word slots) between consecutive occurrences of the same word
+# returns two arrays with the same shape as 'words':
+#   previous: distance to the previous occurrence (-1 for first occurrences and empty slots)
+#   following: distance to the next occurrence; for the last occurrence of a word,
+#              the distance to one slot past the end of the sequence (-1 for empty slots)
+def word_distances(words):
+
+    flat_words = words.ravel()
+    positions = np.nonzero(flat_words >= 0)[0]
+
+    # occurrences grouped by word, in sequence order within each group
+    order = positions[np.lexsort((positions, flat_words[positions]))]
+    sorted_words = flat_words[order]
+
+    gaps = np.diff(order)
+    same_word = sorted_words[1:] == sorted_words[:-1]
+
+    previous = np.full(flat_words.shape, -1, dtype=np.int64)
+    previous[order[1:][same_word]] = gaps[same_word]
+
+    following = np.full(flat_words.shape, -1, dtype=np.int64)
+    following[order[:-1][same_word]] = gaps[same_word]
+
+    last = order[np.append(~same_word, True)] if len(order) > 0 else order
+    following[last] = len(flat_words) + 1 - last
+
+    return previous.reshape(words.shape), following.reshape(words.shape)
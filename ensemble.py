@@ -23,6 +23,8 @@ import os
 import shutil
 
 from config import GLOBALS, OUTPUT_FILES, SEQ_DIR
+from core.music.events import ScoreEvents
+from core.music.smf import write_score_events
 
 
 class Composer(object):
@@ -81,9 +83,17 @@ class Composer(object):
         # assert isinstance(self.alignment, MultipleSeqAlignment)
         return [instrument.Timpani(), instrument.Glockenspiel(), instrument.Vibraphone(), instrument.Marimba()]
 
-    def gen_numerical_vectors(self, k=2, piece_length=5):
+    # alignment profile and instruments used to compose the song
+    def __prepare_alignment__(self):
 
-        msa = AlignIO.read(self.alignment, 'clustal') if not isinstance(self.alignment, np.ndarray) else self.alignment
+        from core import ColumnProfile
+        from core.bio import load_alignment
+
+        # alignment files are read from their (memory-mapped) binary cache
+        if isinstance(self.alignment, str):
+            msa, _ = load_alignment(self.alignment, 'clustal')
+        else:
+            msa = self.alignment
 
         window_sizes = np.zeros(3)
         if 'windows_size' in self.dynamics_algorithm.keys():
@@ -101,12 +111,24 @@ class Composer(object):
 
         assert window_sizes_are_valid, 'Window sizes cannot differ in algorithm mappings'
 
-        from core import gen_song
+        # alignment is profiled once and shared by every stage of gen_song
+        if not isinstance(msa, ColumnProfile):
+            msa = ColumnProfile(msa)
 
         # TODO: insert clustering/instrument assigning algorithm
         instruments = self.assign_instruments()[0:len(msa)]
 
-        songs = gen_song(self.pitch_algorithm, self.durations_algorithm, self.dynamics_algorithm, msa, instruments, k, piece_length=piece_length)
+        return msa, instruments
+
+    # 'workers' > 1 generates the song in a pool of processes, by rows or by pieces (see gen_song)
+    def gen_numerical_vectors(self, k=2, piece_length=5, workers=None, parallel='rows'):
+
+        from core import gen_song
+
+        msa, instruments = self.__prepare_alignment__()
+
+        songs = gen_song(self.pitch_algorithm, self.durations_algorithm, self.dynamics_algorithm, msa, instruments, k,
+                         piece_length=piece_length, workers=workers, parallel=parallel)
 
         assert isinstance(songs, list)
         return songs
@@ -114,6 +136,17 @@ class Composer(object):
         #  dynamics_vector = gen_dynamics_vector(msa, self.dynamics_algorithm)
         # add_dynamics_to_score(dynamics_vector['vol'], score)
 
+    # same as gen_numerical_vectors, yielding each piece as soon as it is composed
+    def iter_scores(self, k=2, piece_length=5, workers=None, parallel='rows'):
+
+        from core import iter_song
+
+        msa, instruments = self.__prepare_alignment__()
+
+        for score in iter_song(self.pitch_algorithm, self.durations_algorithm, self.dynamics_algorithm, msa,
+                               instruments, k, piece_length=piece_length, workers=workers, parallel=parallel):
+            yield score
+
     def play(self):
         pass
 
@@ -123,16 +156,32 @@ class Composer(object):
 
 class FileWriter(object):
 
+    # 'score' is a music21 score or the note events of one (ScoreEvents);
+    # note events are only materialized as music21 objects when an output requires it
     def __init__(self, score, records):
 
-        self.score = score
         self.records = records
 
-        assert isinstance(score, stream.Score) and isinstance(records, np.ndarray)
+        assert isinstance(score, (stream.Score, ScoreEvents)) and isinstance(records, np.ndarray)
+
+        if isinstance(score, ScoreEvents):
+            self.events = score
+            self._score = None
+        else:
+            self.events = None
+            self._score = score
 
         print(score.parts, records)
         assert len(score.parts) == len(records), str(len(score.parts)) + ' ' + str(len(records))
 
+    @property
+    def score(self):
+
+        if self._score is None:
+            self._score = self.events.to_music21()
+
+        return self._score
+
     def write(self, name='alignment', display=False, stats=None, **kwargs):
 
         if len(kwargs.keys()) == 0:
@@ -171,13 +220,17 @@ class FileWriter(object):
 
                 output_midi += value
 
-                f = midi.translate.streamToMidiFile(self.score)
-
                 print('Output MIDI', output_midi)
 
-                f.open(output_midi, attrib='wb')
-                f.write()
-                f.close()
+                # note events are written directly; music21 scores go through streamToMidiFile
+                if self.events is not None:
+                    write_score_events(self.events, output_midi)
+                else:
+                    f = midi.translate.streamToMidiFile(self.score)
+
+                    f.open(output_midi, attrib='wb')
+                    f.write()
+                    f.close()
 
                 import subprocess
 
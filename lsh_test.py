@@ -15,8 +15,11 @@ from music21 import note, stream, duration, tempo
 from Bio.Align import MultipleSeqAlignment
 from Bio import AlignIO
 
+from core import ColumnProfile
+from core.music.similarity import PADDING_CODE
 
-# splits a given sequence from an MSA with alphabet {'A','G','C','T','-'} into shingles
+
+# splits a given (encoded) sequence from an MSA into shingles
 # this technique is based on the k-shingles approach used in document matching algorithms
 def split_into_shingles(sequence, k=2):
 
@@ -28,15 +31,9 @@ def split_into_shingles(sequence, k=2):
     # tokenizer
     n_shingles = length - k + 1  # experimental value !!
 
-    shingles = np.zeros((n_shingles, ), dtype="S" + str(k))
-
-    i = 0
-    while length - i >= k:
-
-        for s in sequence[i : i + k]:
-            shingles[i] += s
-        # shingles[i] = [''.join(s) for s in sequence[i : i + k].astype(str)]
-        i += 1
+    # each shingle holds the k symbol codes as a byte string (see core.encoding)
+    sequence = np.asarray(sequence, dtype=np.uint8).tostring()
+    shingles = np.array([sequence[i: i + k] for i in range(0, n_shingles)], dtype="S" + str(k))
 
     print shingles
     return shingles
@@ -182,7 +179,7 @@ def cluster_by_lsh(sets, k=2, num_perm=128):
         for s in range(0, len(piece)):
 
             # input sequence considering surplus characters
-            sequence = np.empty((n_sequence,), dtype="S1")
+            sequence = np.empty((n_sequence,), dtype=np.uint8)
             sequence[0: n_cols] = piece[s]
 
             if p != n_pieces - 1: # if we aren't on the last piece:
@@ -191,7 +188,7 @@ def cluster_by_lsh(sets, k=2, num_perm=128):
                 sequence[n_cols :] = next_piece[s][0 : k-1]  # surplus
             else:
 
-                sequence[n_cols :] = 'Z' # TODO: possivelmente substituir por valor mais provavel
+                sequence[n_cols :] = PADDING_CODE # TODO: possivelmente substituir por valor mais provavel
 
             shingled_sequence = split_into_shingles(sequence, k=k)
             assert len(shingled_sequence) == n_shingle_elements, \
@@ -347,7 +344,7 @@ print alignment"""
 import config
 msa = AlignIO.read(config.SEQ_DIR + '/clustal3.aln', 'clustal')
 
-msa = np.array([[x for x in y] for y in msa[:, 0:2000]])
+msa = ColumnProfile(msa[:, 0:2000]).codes
 
 msa = np.array([x for x in np.array_split(msa, 5, 1)])
 